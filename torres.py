@@ -22,17 +22,37 @@
 
 
 from manim import *
+from manim.animation.animation import prepare_animation
+from manim.utils.sounds import get_full_sound_file_path
+from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError
 import random 
+import re
 from math import *
+from array import array
+import cairo
+import json
+from collections import OrderedDict
+import mmap
+import concurrent.futures
+import threading
+import os
+import socketserver
+import socket
+import subprocess
+import sys
+import wave
 
 # colors
 EMPY_SET_COLOR = RED
 BORDER_COLOR = WHITE
 HIGHLIGHT_BORDER_COLOR = YELLOW
+SUMMARY_COLOR = GRAY
 
 # braces
 open_braces = { "(", "[", "{", "<" }
 close_braces = { ")", "]", "}", ">" }
+matching_braces = { ")": "(", "]": "[", "}": "{", ">": "<" }
 
 # spacing and heights
 STD_SPACING = 0.06                      
@@ -58,6 +78,42 @@ DISPLAY_SPACING = 0.25
 
 # 🎆🎇✨🎻🪕  
 
+# Wobble: rotates a mobject by angle and back in a single animation.
+# The rotation is applied incrementally about a fixed point, so no copy of the 
+# mobject is made (neither a starting mobject nor a saved state).
+# The default rate function goes out, pauses and comes back.
+class Wobble(Animation):
+
+    def __init__(
+        self, mobject, angle = PI/6, about_point = None, 
+        rate_func = there_and_back_with_pause, **kwargs
+    ):
+        self.angle = angle
+        self.about_point = about_point
+        self.current_angle = 0
+        super().__init__(mobject, rate_func = rate_func, **kwargs)
+
+    # run time equivalent to rotate out, wait, rotate back
+    @staticmethod
+    def duration( transitions_run_time, pause = 0.05 ):
+        return 2*transitions_run_time + pause
+
+    def create_starting_mobject(self):
+        return Mobject()
+
+    def begin(self):
+        if self.about_point is None:
+            self.about_point = self.mobject.get_center()
+        self.current_angle = 0
+        super().begin()
+
+    def interpolate_mobject(self, alpha):
+        angle = self.angle * self.rate_func(alpha)
+        self.mobject.rotate( angle - self.current_angle, about_point = self.about_point )
+        self.current_angle = angle
+
+
+
 # Tower Structure. This class is NOT IN USE.
 # This represents the structure of a tower. 
 # The class has not been actually used in the final project.
@@ -69,6 +125,9 @@ DISPLAY_SPACING = 0.25
 class Tower(VGroup):
 
     instrument_icon = None
+    summary = None          # blocks collapsed in this block (see from_set)
+    summary_set = None      # (sets, id) of the set collapsed in a summary or collapsed block
+    collapsed = None        # string and sizes of a collapsed subtower (see from_string_lod)
 
     # constructor
     def __init__(
@@ -90,16 +149,15 @@ class Tower(VGroup):
         self.submobjects.append(self.parts)
         self.submobjects.append(self.subtowers)
 
+        # a single path draws both the fill and the border of the block:
+        # recolor the fill with set_fill and the border with set_stroke
         self.rect = RoundedRectangle(
-            width=block_width, height=block_height, corner_radius=corner_radius, fill_opacity=1, color=BLUE_D
-        )
-        self.border = RoundedRectangle(
-            width=block_width, height=block_height, corner_radius=corner_radius, color=BORDER_COLOR,
-            stroke_width=border_width
+            width=block_width, height=block_height, corner_radius=corner_radius, 
+            fill_color=BLUE_D, fill_opacity=1, 
+            stroke_color=BORDER_COLOR, stroke_width=border_width
         )
 
         self.parts.add(self.rect)
-        self.parts.add(self.border)
 
     # count descendants
     def count_descendants(self):
@@ -121,9 +179,13 @@ class Tower(VGroup):
     
     
 
-    # count floors    
+    # count floors (a summary or collapsed block has the floors of its set)
     def count_floors(self):
 
+        if self.summary_set is not None:
+            sets, i = self.summary_set
+            return sets.depth(i)
+
         max = 0
 
         if not self.subtowers is None:
@@ -139,20 +201,20 @@ class Tower(VGroup):
     def set_block_border_color(self, scene, color, transition_run_time=0.5):
 
         scene.play( 
-            self.border.animate.set_color(color), run_time=transition_run_time 
+            self.rect.animate.set_stroke(color), run_time=transition_run_time 
         )
 
     # set block border color
     def set_block_color(self, scene, color, transition_run_time=0.5):
 
         scene.play( 
-            self.parts.animate.set_color(color), run_time=transition_run_time 
+            self.rect.animate.set_color(color), run_time=transition_run_time 
         )
 
     # set tower border color
     def set_tower_border_color(self, scene, color, transition_run_time=0.05):
         scene.play( 
-            self.border.animate.set_color(color), run_time=transition_run_time 
+            self.rect.animate.set_stroke(color), run_time=transition_run_time 
         )
 
         for st in self.subtowers:
@@ -219,7 +281,7 @@ class Tower(VGroup):
         self.submobjects[1] = self.subtowers    
 
         if len(subtowers) == 0:
-            self.rect.set_color( EMPY_SET_COLOR )
+            self.rect.set_fill( EMPY_SET_COLOR )
             
         for st in subtowers:
             self.subtowers.add(st)      
@@ -232,12 +294,12 @@ class Tower(VGroup):
         self.subtowers = VGroup()
         self.submobjects[1] = self.subtowers    
 
-        self.rect.set_color( Tower.select_color_by_level(level, color_type) )
+        self.rect.set_fill( Tower.select_color_by_level(level, color_type) )
 
         n = len(subtowers)
 
         if n==0:
-            self.rect.set_color( EMPY_SET_COLOR )
+            self.rect.set_fill( EMPY_SET_COLOR )
             
         if n>0:            
             subtowers_width = ( self.block_width - (n+1) * SPACING ) / n
@@ -296,6 +358,176 @@ class Tower(VGroup):
                 
                 i = end + 1
 
+    # Tower from string with level of detail: blocks smaller than min_pixels 
+    # (at the configured resolution, times zoom) are not built, the block and its 
+    # subtowers become one block of the colour of the block, high as the whole subtower.
+    # Sizes are computed first with TowerSketch (same layout, no mobjects).
+    # Collapsed blocks keep their substring in collapsed, see expand_visible,
+    # and the canonical id of their set in summary_set.
+    @staticmethod
+    def from_string_lod(
+        string, min_pixels = 2, zoom = 1,
+        block_width = 2, block_height = 1, corner_radius = CORNER_RADIUS,
+        border_width = BORDER_WIDTH, level = 0, color_type = 0, scale = 1
+    ):
+        string = string.replace(' ', '')        
+        sketch = TowerSketch(string, block_width, block_height, corner_radius, border_width, color_type)
+        extents = sketch.extents()
+
+        # minimum size in units of the tower as built (before a final scale)
+        min_size = min_pixels * config.frame_width / (config.pixel_width * zoom * scale)
+
+        t, _ = Tower.build_lod(
+            string, 0, [0], sketch.children, extents, min_size, 
+            block_width, block_height, corner_radius, border_width, level, color_type
+        )
+        return t
+
+    # recursive step of from_string_lod, counter holds the index of the next block
+    # returns (the tower, the index where it stopped)
+    @staticmethod
+    def build_lod(
+        string, start, counter, children, extents, min_size,
+        block_width, block_height, corner_radius, border_width, level, color_type
+    ):
+        k = counter[0]
+        counter[0] += 1
+        width, height, tower_height = extents[3*k], extents[3*k+1], extents[3*k+2]
+
+        t = Tower(                      
+            block_width, block_height, corner_radius*(CORNER_RATIO**level), border_width
+        )
+
+        if Tower.is_collapsed_size(width, height, min_size):
+            # skip the subtower, counting its blocks
+            depth = 0
+            i = start
+            while True:
+                if string[i] in open_braces:
+                    depth += 1
+                    if i>start:
+                        counter[0] += 1
+                elif string[i] in close_braces:
+                    depth -= 1
+                    if depth == 0:
+                        break
+                i += 1
+
+            # sizes are in the units of the whole tower, the block is built at block_width
+            t = Tower(                      
+                block_width, tower_height * block_width / width if width>0 else block_height, 
+                corner_radius*(CORNER_RATIO**level), border_width
+            )
+            if children[k] == 0:
+                t.rect.set_fill( EMPY_SET_COLOR )
+            else:
+                t.rect.set_fill( Tower.select_color_by_level(level, color_type) )
+            t.collapsed = (
+                string[start:i+1], block_width, block_height, corner_radius, border_width, 
+                level, color_type
+            )
+            t.summary_set = ( canonical_sets, canonical_sets.of_string(string[start:i+1]) )
+            return t, i
+
+        st = []
+        i = start + 1
+        while i<len(string):
+            if string[i] in close_braces:
+                t.set_and_resize_subtowers(st, level, color_type)
+                return t, i
+
+            if string[i] in open_braces:
+                sub_tower, i = Tower.build_lod(
+                    string, i, counter, children, extents, min_size,
+                    block_width*0.5, block_height*FLOOR_RATIO, corner_radius, border_width, 
+                    level+1, color_type
+                )
+                st.append(sub_tower)
+
+            i += 1
+
+    # a block smaller than min_size in width or height is collapsed (see from_string_lod)
+    @staticmethod
+    def is_collapsed_size(width, height, min_size):
+        return width<min_size or height<min_size
+
+    # expands the collapsed blocks (see from_string_lod) that are now large enough,
+    # for instance after a zoom of the camera: in the scene the collapsed blocks
+    # are replaced by the expanded subtowers. Returns the number of expanded blocks.
+    def expand_visible(self, scene, min_pixels = 2, zoom = 1):
+
+        if self.subtowers is None:
+            return 0
+
+        pixels = config.pixel_width * zoom / config.frame_width
+        expanded = 0
+        for k in range(len(self.subtowers)):
+            t = self.subtowers[k]
+
+            if t.collapsed is None:
+                expanded += t.expand_visible(scene, min_pixels, zoom)
+                continue
+
+            # the block as it would be built (its height, not the one of the subtower)
+            string, block_width, block_height, corner_radius, border_width, level, color_type = t.collapsed
+            width = t.parts.width
+            height = block_height * width / block_width
+            if Tower.is_collapsed_size(width*pixels, height*pixels, min_pixels):
+                continue
+
+            new = Tower.from_string_lod(
+                string, min_pixels, zoom, block_width, block_height, corner_radius, 
+                border_width, level, color_type, scale = t.parts.width / block_width
+            )
+            if new.collapsed is not None:
+                continue
+
+            new.set_block_width( t.parts.width, level )
+            new.align_to( t.parts.get_left(), LEFT )
+            new.align_to( t.parts.get_bottom(), DOWN )
+            self.subtowers.submobjects[k] = new
+            scene.remove( *t.get_family() )
+            scene.add( new )
+            expanded += 1
+
+        return expanded
+
+    # tower from a canonical set id (see CanonicalSets), members in order of id.
+    # Only max_levels levels are built: deeper non empty sets become one summary block
+    # (SUMMARY_COLOR) that stores in summary the number of blocks it stands for,
+    # and in summary_set the set it stands for.
+    @staticmethod
+    def from_set(
+        i, sets = None, max_levels = 4,
+        block_width = 2, block_height = 1, corner_radius = CORNER_RADIUS,
+        border_width = BORDER_WIDTH, level = 0, color_type = 0
+    ):
+        if sets is None:
+            sets = canonical_sets
+
+        t = Tower(                      
+            block_width, block_height, corner_radius*(CORNER_RATIO**level), border_width
+        )
+
+        members = sorted( sets.members(i) )
+        if level >= max_levels and len(members)>0:
+            t.rect.set_fill( SUMMARY_COLOR )
+            t.summary = sets.expanded_size(i) - 1
+            t.summary_set = (sets, i)
+            return t
+
+        st = [
+            Tower.from_set(
+                m, sets, max_levels,
+                block_width*0.5, block_height*FLOOR_RATIO, corner_radius, border_width,
+                level = level+1, color_type = color_type
+            ) 
+            for m in members
+        ]
+        t.set_and_resize_subtowers(st, level, color_type)
+
+        return t
+
     # select instrument 
     @staticmethod
     def select_instrument(probabilities):
@@ -408,8 +640,8 @@ class Tower(VGroup):
         )
 
         color = Tower.select_color_by_level(level, color_type)
-        container.rect.set_color( color )
-        container.border.set_color( BORDER_COLOR ) 
+        container.rect.set_fill( color )
+        container.rect.set_stroke( BORDER_COLOR )
 
         return container
 
@@ -451,15 +683,11 @@ class Tower(VGroup):
                 t.animate.shift([0, container.block_height, 0 ]),
                 run_time = transitions_run_time
             )
-            t.save_state()
             scene.play(
-                Rotate(t,PI/6), 
+                Wobble(t, PI/6), 
                 *scene.instrument_display.vibrate(instruments, level ),
-                run_time = transitions_run_time
+                run_time = Wobble.duration(transitions_run_time)
             )
-            scene.wait( 0.05 )
-            scene.play(Rotate(t,-PI/6), run_time = transitions_run_time)
-            t.restore()
 
             scene.play( 
                 container.animate.shift( [-t.block_width-SPACING, 0, 0] ),
@@ -517,26 +745,18 @@ class Tower(VGroup):
             instruments = scene.instrument_player.play_sound( level, count_children )
 
             scene.play( 
-                t.animate.align_to( base.border.get_top(), DOWN ),
+                t.animate.align_to( base.rect.get_top(), DOWN ),
                 run_time = transitions_run_time
             )
-            t.save_state()
             scene.play(
-                Rotate(t,PI/6), 
+                Wobble(t, PI/6), 
                 *scene.instrument_display.vibrate(instruments, level ),
                 *scene.level_display.update(level=level ),
                 *scene.subtowers_display.update(subtowers=count_children ),
-                run_time = transitions_run_time
-            )
-            scene.wait( 0.05 )  
-
-            scene.play(
-                Rotate(t,-PI/6),
                 base.parts.animate.align_to( t, LEFT ),
                 *scene.earth.vibrate(1.01, 0.01),
-                run_time = transitions_run_time  
+                run_time = Wobble.duration(transitions_run_time)
             )
-            t.restore()
 
 
         scene.play(
@@ -586,25 +806,17 @@ class Tower(VGroup):
             instruments = scene.instrument_player.play_sound( level, count_children )
 
             scene.play( 
-                t.animate.align_to( base.border.get_top(), DOWN ),
+                t.animate.align_to( base.rect.get_top(), DOWN ),
                 run_time = transitions_run_time
             )
-            t.save_state()
             scene.play(
-                Rotate(t,-PI/6), 
+                Wobble(t, -PI/6), 
                 *scene.instrument_display.vibrate(instruments, level ),
                 *scene.level_display.update(level=level ),
                 *scene.subtowers_display.update(subtowers=count_children ),
-                run_time = transitions_run_time
-            )
-            scene.wait( 0.05 )  
-
-            scene.play(
-                Rotate(t,PI/6),
                 base.parts.animate.align_to( t, RIGHT ),
-                run_time = transitions_run_time  
+                run_time = Wobble.duration(transitions_run_time)
             )
-            t.restore()
 
 
         scene.play(
@@ -618,6 +830,194 @@ class Tower(VGroup):
 
 
 
+    # (level, children) of the sounds played by raise_tower, in order
+    def raise_events(self):
+
+        events = []
+        self.collect_raise_events(events)
+        return events
+
+    # appends the events of the tower, returns its floors
+    def collect_raise_events(self, events):
+
+        if self.subtowers is None or len(self.subtowers) == 0:
+            return self.count_floors()
+
+        floors = [ t.collect_raise_events(events) for t in self.subtowers ]
+        for i in range(len(self.subtowers)-1, -1, -1):
+            events.append( (floors[i], self.subtowers[i].count_children()) )
+
+        return max(floors) + 1
+
+    # raise tower in a given duration (seconds), whatever the size of the tower:
+    # - the transition time of raise_tower is scaled to fit the duration, 
+    # - if it would be shorter than a frame, the children of a block are raised 
+    #   together in two plays (see raise_towers_with_base_batched),
+    # - if there is no time for that either, the smallest subtrees appear already built,
+    # and the notes are thinned to max_notes_per_second.
+    def raise_tower_in( self, scene, duration, max_notes_per_second = 10 ):
+
+        scene.max_notes_per_second = max_notes_per_second
+
+        plan, measures = self.plan_raise_in(duration)
+        if plan[0] == "scaled":
+            scene.instrument_player.plan( self.raise_events() )
+            return self.raise_tower(scene, transitions_run_time = plan[1])
+
+        _, run_time, min_size = plan
+        events = []
+        self.collect_batched_events(measures, min_size, events)
+        scene.instrument_player.plan( events )
+        self.raise_tower_batched(scene, run_time, measures, min_size)
+
+    # how raise_tower_in builds the tower in a duration: ("scaled", transitions run time)
+    # or ("batched", run time, min size), and the measures of the blocks
+    def plan_raise_in( self, duration ):
+
+        frame = 1 / config.frame_rate
+
+        measures = {}
+        self.measure(measures)
+        internal = [ m for m in measures.values() if m[2] > 0 ]
+        if len(internal) == 0:
+            return ("scaled", 0.05), measures
+
+        # raise_tower takes 5 transitions per block and a transition and a wobble per child
+        blocks = len(internal)
+        events = sum( m[2] for m in internal )
+        pause = 0.05
+        t = floor( (duration - pause*events) / (5*blocks + 3*events) / frame ) * frame
+        if t >= frame:
+            return ("scaled", t), measures
+
+        # two plays per animated block: the biggest subtrees are animated
+        plays = max( 1, floor( duration / (2*frame) ) )
+        sizes = sorted( [ m[0] for m in internal ], reverse = True )
+        min_size = sizes[plays] if plays < len(sizes) else 0
+        animated = len( [ size for size in sizes if size > min_size ] )
+        run_time = max( floor( duration / (2*animated) / frame ) * frame, frame )
+
+        return ("batched", run_time, min_size), measures
+
+    # the sounds of raise_tower on a clock (see NoteClock): the plays and waits
+    # of raise_towers_with_base as run times, no animation
+    def raise_tower_clock( self, clock, player, transitions_run_time = 0.05 ):
+
+        if self.subtowers is None or len(self.subtowers) == 0:
+            return
+
+        for t in self.subtowers:
+            t.raise_tower_clock(clock, player, transitions_run_time)
+
+        clock.wait(transitions_run_time)
+        clock.play(transitions_run_time)
+        clock.wait(transitions_run_time)
+        for i in range(len(self.subtowers)-1, -1, -1):
+            t = self.subtowers[i]
+            player.play_sound( t.count_floors(), t.count_children() )
+            clock.play(transitions_run_time)
+            clock.play( Wobble.duration(transitions_run_time) )
+        clock.play(transitions_run_time)
+        clock.wait(transitions_run_time)
+
+    # the sounds of raise_tower_batched on a clock
+    def raise_tower_batched_clock( self, clock, player, run_time, measures, min_size = 0 ):
+
+        size, _, children = measures[id(self)]
+        if children == 0 or size <= min_size:
+            return
+
+        for t in self.subtowers:
+            t.raise_tower_batched_clock(clock, player, run_time, measures, min_size)
+
+        clock.play(run_time)
+        for i in range(len(self.subtowers)-1, -1, -1):
+            _, floors, count = measures[ id(self.subtowers[i]) ]
+            player.play_sound( floors, count )
+        clock.play(run_time)
+
+    # measures of the blocks of the tower: id -> (descendants, floors, children)
+    def measure(self, measures):
+
+        size, floors, children = 1, 0, 0
+        if self.summary_set is not None:
+            floors = self.count_floors()
+        if self.subtowers is not None:
+            children = len(self.subtowers)
+            for t in self.subtowers:
+                s, f = t.measure(measures)
+                size += s
+                floors = max(floors, f + 1)
+
+        measures[id(self)] = (size, floors, children)
+        return size, floors
+
+    # events of raise_tower_batched, in order
+    def collect_batched_events(self, measures, min_size, events):
+
+        size, _, children = measures[id(self)]
+        if children == 0 or size <= min_size:
+            return
+
+        for t in self.subtowers:
+            t.collect_batched_events(measures, min_size, events)
+        for i in range(len(self.subtowers)-1, -1, -1):
+            _, floors, count = measures[ id(self.subtowers[i]) ]
+            events.append( (floors, count) )
+
+    # raise tower with the children of each block raised together,
+    # subtrees not bigger than min_size are placed already built
+    def raise_tower_batched(self, scene, run_time, measures, min_size = 0):
+
+        floor_level = scene.earth.get_level()
+        size, _, children = measures[id(self)]
+
+        if children == 0 or size <= min_size:
+            self.shift( [ 0, floor_level - self.get_bottom()[1] , 0 ] )
+            scene.add( self )
+            return
+
+        for t in self.subtowers:
+            t.raise_tower_batched(scene, run_time, measures, min_size)
+
+        Tower.raise_towers_with_base_batched( scene, self.subtowers, self, run_time, measures )
+
+    # raise towers on a base with two plays: the base appears under the towers 
+    # as they go up, then they all wobble with their sounds
+    @staticmethod
+    def raise_towers_with_base_batched( scene, towers, base, run_time, measures ):
+
+        left = Tower.get_left_of_towers( towers )
+        right = Tower.get_right_of_towers( towers )
+        bottom = Tower.get_bottom_of_towers( towers )
+
+        base.parts.align_to( [0, bottom, 0], DOWN )
+        base.parts.shift( [ (left+right)/2 - base.parts.get_center()[0], 0, 0 ] )
+        top = base.rect.get_top()
+
+        scene.play( 
+            FadeIn(base.parts),
+            *[ t.animate.align_to( top, DOWN ) for t in towers ],
+            run_time = run_time
+        )
+
+        instruments = []
+        level = 0
+        for i in range(len(towers)-1, -1, -1):
+            _, floors, count = measures[ id(towers[i]) ]
+            level = max(level, floors)
+            for n in scene.instrument_player.play_sound( floors, count ):
+                if n not in instruments:
+                    instruments.append(n)
+
+        scene.play(
+            *[ Wobble(t, PI/6) for t in towers ],
+            *scene.instrument_display.vibrate(instruments, level ),
+            *scene.level_display.update(level=level ),
+            *scene.subtowers_display.update(subtowers=len(towers) ),
+            run_time = run_time
+        )
+
     # raise tower: builds a towers showing animation and music
     # moves the existing layers to reach each one its position
     def raise_tower( 
@@ -684,13 +1084,13 @@ class Tower(VGroup):
             self.raise_towers_with_base(
                 scene, [t], new_base, transitions_run_time = transitions_run_time
             )
-            scene.play( new_base.rect.animate.set_color(BLUE_A) )
+            scene.play( new_base.rect.animate.set_fill(BLUE_A) )
 
         return new_bases
 
     def add_base( self, scene, color, height = 1, transitions_run_time= 0.05 ):
         base , _ = Tower.from_string_bottom_up( " ( ) ", 0,  self.parts.width, height, 0.1 )
-        base.rect.set_color(color)
+        base.rect.set_fill(color)
         base.move_to( self )
         base.align_to( self.get_bottom(), DOWN)
 
@@ -762,7 +1162,7 @@ class Tower(VGroup):
                     run_time = drop_run_time 
                 )
             instruments = scene.instrument_player.play_sound( level, 0 )
-            scene.play( 
+            scene.queue_hud( 
                 *scene.instrument_display.vibrate(instruments, level ),
                 *scene.level_display.update(level=level ),
                 *scene.earth.vibrate(),
@@ -781,7 +1181,7 @@ class Tower(VGroup):
             run_time = drop_run_time 
         )
         instruments = scene.instrument_player.play_sound( level, children )
-        scene.play( 
+        scene.queue_hud( 
             *scene.instrument_display.vibrate(instruments, level ),
             *scene.level_display.update(level=level ),
             *scene.earth.vibrate(),
@@ -799,7 +1199,7 @@ class Tower(VGroup):
             run_time = drop_run_time 
         )
         instruments = scene.instrument_player.play_sound( level, children )
-        scene.play( 
+        scene.queue_hud( 
             *scene.instrument_display.vibrate(instruments, level ),
             *scene.level_display.update(level=level ),
             *scene.earth.vibrate(),
@@ -872,6 +1272,262 @@ class Tower(VGroup):
 
         return not self.equals(other)
 
+    # canonical id of the set represented by the tower (see CanonicalSets)
+    def canonical_id(self, sets = None):
+
+        if sets is None:
+            sets = canonical_sets
+
+        return sets.of_tower(self)
+
+    # canonical ids of the subtowers
+    def subtower_ids(self, sets = None):
+
+        if self.subtowers is None:
+            return []
+
+        return [ t.canonical_id(sets) for t in self.subtowers ]
+
+    # indicates the subtowers of other that are also in this set, 
+    # returns the ids of the subtowers of other
+    def indicate_common_subtowers(self, scene, other, step_run_time = 0.3):
+
+        own_ids = set( self.subtower_ids() )
+        other_ids = other.subtower_ids()
+
+        for t, i in zip(other.subtowers, other_ids):
+            if i in own_ids:
+                scene.play( Indicate(t), run_time = step_run_time )
+
+        return other_ids
+
+    # subtowers as a list (empty for a block without subtowers)
+    @staticmethod
+    def children_of(tower):
+
+        if tower.subtowers is None:
+            return []
+
+        return list(tower.subtowers)
+
+    # Morphs this tower into other, laid out where it has to end (and not in the scene).
+    # The blocks paired by the edit script (see TreeEdit) are reused and animated 
+    # only if they move or change colour, the others fade out or in.
+    # Returns other, made of the reused blocks.
+    def morph_to(self, scene, other, run_time = 1):
+
+        edit = TreeEdit().diff(self, other)
+
+        animations = [ 
+            Transform( a.rect, b.rect.copy() ) 
+            for a, b in edit.pairs if not TreeEdit.same_block(a, b) 
+        ]
+        animations += [ FadeOut(a.rect) for a in edit.deleted ]
+        animations += [ FadeIn(b.rect) for b in edit.inserted ]
+        if len(animations) > 0:
+            scene.play( *animations, run_time = run_time )
+
+        scene.remove( *self.get_family() )
+        for a, b in edit.pairs:
+            parts = b.parts.submobjects
+            parts[ parts.index(b.rect) ] = a.rect
+            b.rect = a.rect
+        scene.add(other)
+
+        return other
+
+    # Applies rewrite rules (see RewriteRule) one after the other: a rule rewrites 
+    # all its matches at once, in one play, the matched blocks becoming towers of 
+    # the results (see from_set, max_levels levels below each match). Only the paths 
+    # to the matches are visited: the sets without matches inside are known by canonical id.
+    # Returns the tower (a new one if the whole tower is rewritten).
+    def rewrite(self, scene, rules, run_time = 1, max_levels = 4, color_type = 1):
+
+        tower = self
+        ids = {}
+        for rule in rules:
+            if id(tower) not in ids:
+                Tower.collect_ids(tower, ids, rule.sets)
+
+            found, parents = Tower.find_rewrites(tower, rule, ids)
+            if len(found) == 0:
+                continue
+
+            news = []
+            for t, depth, r in found:
+                new = Tower.from_set(
+                    r, rule.sets, depth + max_levels, t.block_width, t.block_height, 
+                    level = depth, color_type = color_type
+                )
+                new.align_to( t.get_bottom(), DOWN )
+                new.shift( [ t.rect.get_center()[0] - new.rect.get_center()[0], 0, 0 ] )
+                news.append(new)
+
+            level = max( depth for _, depth, _ in found )
+            instruments = scene.instrument_player.play_sound( level, len(found) )
+            scene.play( 
+                *[ Transform( t, new.copy() ) for (t, _, _), new in zip(found, news) ], 
+                *scene.instrument_display.vibrate(instruments, level ),
+                run_time = run_time 
+            )
+
+            # the transformed blocks are swapped with the new towers, in the tower 
+            # and in the scene (removing a block splits its ancestors in the scene:
+            # the tower is added back whole)
+            ancestors = {}
+            for (t, depth, _), new in zip(found, news):
+                Tower.collect_ids(new, ids, rule.sets)
+                parent = parents[id(t)]
+                scene.remove( *t.get_family() )
+                if parent is None:
+                    scene.add(new)
+                    tower = new
+                    continue
+
+                subtowers = parent.subtowers.submobjects
+                subtowers[ subtowers.index(t) ] = new
+                while parent is not None:
+                    depth -= 1
+                    ancestors[id(parent)] = (depth, parent)
+                    parent = parents[id(parent)]
+
+            if len(ancestors) > 0:
+                scene.add(tower)
+
+            # the ids of the ancestors change, deepest first
+            for _, a in sorted( ancestors.values(), key = lambda e: -e[0] ):
+                ids[id(a)] = rule.sets.intern( ids[id(c)] for c in a.subtowers )
+
+        return tower
+
+    # canonical ids of the blocks of a tower: id(block) -> set id
+    # (a summary block has the id of the set it stands for)
+    @staticmethod
+    def collect_ids(tower, ids, sets):
+
+        if tower.summary_set is not None:
+            ids[id(tower)] = sets.of_tower(tower)
+        else:
+            ids[id(tower)] = sets.intern( Tower.collect_ids(t, ids, sets) for t in Tower.children_of(tower) )
+        return ids[id(tower)]
+
+    # outermost blocks matched by a rule [(block, depth, rewritten set id)],
+    # and the parents of the visited blocks
+    @staticmethod
+    def find_rewrites(tower, rule, ids):
+
+        contains = {}
+        def contains_match(i):
+            if i not in contains:
+                contains[i] = rule.apply(i) is not None or any( 
+                    contains_match(m) for m in rule.sets.members(i) 
+                )
+            return contains[i]
+
+        found = []
+        parents = { id(tower): None }
+        stack = [ (tower, 0) ]
+        while len(stack) > 0:
+            t, depth = stack.pop()
+            i = ids[id(t)]
+
+            if rule.depth is None or rule.depth == depth:
+                r = rule.apply(i)
+                if r is not None:
+                    found.append( (t, depth, r) )
+                    continue
+
+            if rule.depth is not None and depth >= rule.depth:
+                continue
+            if rule.depth is None and not contains_match(i):
+                continue
+
+            for c in Tower.children_of(t):
+                parents[id(c)] = t
+                stack.append( (c, depth + 1) )
+
+        return found, parents
+
+    # set union with another tower standing on earth (extensional: no duplicates). 
+    # The bases are removed, the members fall on the earth, duplicates are erased 
+    # and a new base is raised. Returns the new tower.
+    def set_union(self, scene, other, step_run_time = 0.3):
+
+        return Tower.merge_members(
+            scene, [self, other], lambda i, count: True, step_run_time
+        )
+
+    # set symmetric difference with another tower standing on earth: 
+    # the members in both sets are erased, the others are merged. Returns the new tower.
+    def set_symmetric_difference(self, scene, other, step_run_time = 0.3):
+
+        return Tower.merge_members(
+            scene, [self, other], lambda i, count: count == 1, step_run_time
+        )
+
+    # set intersection with another tower standing on earth: the common members 
+    # are shown, the others are erased and the common ones merged. Returns the new tower.
+    def set_intersection(self, scene, other, step_run_time = 0.3):
+
+        self.indicate_common_subtowers(scene, other, step_run_time)
+
+        return Tower.merge_members(
+            scene, [self, other], lambda i, count: count == 2, step_run_time
+        )
+
+    # set difference with another tower standing on earth: the common members
+    # are shown, then they and the other members of other are erased. Returns the new tower.
+    def set_difference(self, scene, other, step_run_time = 0.3):
+
+        other_ids = set( self.indicate_common_subtowers(scene, other, step_run_time) )
+
+        return Tower.merge_members(
+            scene, [self, other], lambda i, count: i not in other_ids, step_run_time
+        )
+
+    # Merges the members of towers under a new base.
+    # keep(id, count) tells if a member is kept, count is the number of towers having it;
+    # only the first copy of a kept member survives.
+    @staticmethod
+    def merge_members(scene, towers, keep, step_run_time = 0.3):
+
+        members = []
+        counts = {}
+        for t in towers:
+            ids = t.subtower_ids()
+            if t.subtowers is not None:
+                members += zip(t.subtowers, ids)
+            for i in set(ids):
+                counts[i] = counts.get(i, 0) + 1
+
+        kept = []
+        seen = set()
+        for t, i in members:
+            if keep(i, counts[i]) and i not in seen:
+                seen.add(i)
+                kept.append(t)
+            else:
+                scene.play( Indicate(t), run_time = step_run_time )
+                scene.add_sound( "./sounds/laser1.wav", gain = -4 )
+                scene.play( Uncreate(t), run_time = step_run_time )
+
+        scene.play( *[ Uncreate(t.parts) for t in towers ], run_time = step_run_time )
+
+        # the operands are consumed: the kept members come back with their drop
+        for t in towers:
+            scene.remove( *t.get_family() )
+
+        for t in kept:
+            t.drop_tower(scene, drop_run_time = step_run_time)
+
+        if len(kept) == 0:
+            base , _ = Tower.from_string_bottom_up( " ( ) ", 0, 2, 0.6, 0.3 )
+            base.drop_tower(scene, drop_run_time = step_run_time)
+            return base
+
+        kept.sort( key = lambda t: t.get_left()[0] )
+        return Tower.raise_towers(scene, kept, transitions_run_time = step_run_time/6)
+
     # remove duplicate subtowers
     def remove_duplicate_subtowers(self, scene, step_run_time):
         if self.subtowers is None:
@@ -992,488 +1648,2670 @@ class Tower(VGroup):
             self.center_subtowers(scene)
 
 
+    # moves the tower out of the frame and removes it (with all its parts, 
+    # that may have been added to the scene one by one)
     def flush(self, scene, run_time=0.05):
 
         scene.play( self.animate.align_to([-9, 0, 0], RIGHT), run_time=run_time)
+        scene.remove( *self.get_family() )
 
 
 
 
 # ---------------------------------
 
-# base class for instrument displays (they implement vibrate)
-class InstrumentDisplay():
+# Canonical ids of (hereditarily finite) sets, by hash consing.
+# A set is stored once, as the frozenset of the ids of its members, so sets that are
+# equal by extensionality (any order, any repetition) get the same id, and comparing
+# sets or looking them up is comparing ints. The empty set has id 0.
+class CanonicalSets():
 
-    def __init__(self, instruments, colors) -> None:
-        self.icons = []
+    def __init__(self) -> None:
+        self.ids = { frozenset(): 0 }
+        self.sets = [ frozenset() ]
+        self.expanded_sizes = {}
+        self.depths = {}
 
-        for i in range(len(instruments)):
-            self.icons.append( self.get_icon(instruments[i], colors[i]) )
+    # an index is shared: copies of the towers refer to the same one (see summary_set)
+    def __deepcopy__(self, memo):
+        return self
 
-    def get_icon(self, instrument, color = None):
+    # id of the set with the given member ids
+    def intern(self, members):
 
-        if color is not None:
-            instrument.icon.set_color(color)
+        members = frozenset(members)
+        i = self.ids.get(members)
+        if i is None:
+            i = len(self.sets)
+            self.ids[members] = i
+            self.sets.append(members)
 
-        return instrument.icon
+        return i
 
-    
-    def vibrate( self, instruments, level, subtowers = None ):
-        pass
+    def members(self, i):
+        return self.sets[i]
 
-# display with separate instruments
-class InstrumentSeparateDisplay(InstrumentDisplay):
+    def size(self, i):
+        return len(self.sets[i])
 
-    def __init__(
-            self, scene, instruments, colors, on_opacities, off_opacities
-    ) -> None:
-        super().__init__(instruments, colors)
+    def contains(self, i, member):
+        return member in self.sets[i]
 
-        self.scene = scene
-        self.instruments = instruments
-        self.colors = colors
-        self.on_opacities = on_opacities
-        self.off_opacities = off_opacities
-        self.instrument_count = len(instruments)
+    def is_subset(self, i, j):
+        return self.sets[i] <= self.sets[j]
 
-        self.rect = RoundedRectangle(
-            width=self.instrument_count, height=1, corner_radius=0.3, 
-            color=BORDER_COLOR, stroke_width=2
-        )
-        self.rect.move_to([0,TOP_MARGIN-DISPLAY_HEIGHT,0])
-        self.rect.align_to([RIGHT_MARGIN,0,0], RIGHT)
+    def union(self, i, j):
+        return self.intern( self.sets[i] | self.sets[j] )
 
-        for i in range(len(self.icons)):
-            self.icons[i].move_to([RIGHT_MARGIN-DISPLAY_WIDTH/2-i, self.rect.get_center()[1], 0])
-            scene.add( self.rect ) 
-            scene.add( self.icons[i] ) 
-            self.icons[i].set_opacity(0)
+    def intersection(self, i, j):
+        return self.intern( self.sets[i] & self.sets[j] )
 
-    
-    def vibrate( self, indices, level, subtowers = None ):
-        for i in range(len(self.instruments)):
-            if i in indices:
-                self.icons[i].set_opacity(self.on_opacities[i])
-            else:
-                self.icons[i].set_opacity(self.off_opacities[i])
+    def difference(self, i, j):
+        return self.intern( self.sets[i] - self.sets[j] )
 
-        return [
-            Wiggle(self.icons[index], 1.2, 0.2, 4) for index in indices
-        ]
+    def symmetric_difference(self, i, j):
+        return self.intern( self.sets[i] ^ self.sets[j] )
 
-# display that alternates instruments
-class InstrumentAlternateDisplay(InstrumentDisplay):
+    def singleton(self, i):
+        return self.intern( [i] )
 
-    def __init__(self, scene, instruments, colors, off_opacity=0.1 ) -> None:
-        super().__init__(instruments, colors)
+    def pair(self, i, j):
+        return self.intern( [i, j] )
 
-        self.scene = scene
-        self.instruments = instruments
-        self.colors = colors
-        self.current_icon = None
-        self.off_opacity = off_opacity
+    # von Neumann successor: i ∪ {i}
+    def successor(self, i):
+        return self.intern( self.sets[i] | {i} )
 
-        self.rect = RoundedRectangle(
-            width=1, height=1, corner_radius=0.3, color=BORDER_COLOR, stroke_width=2
-        )
-        self.rect.move_to([0,TOP_MARGIN-DISPLAY_HEIGHT,0])
-        self.rect.align_to([RIGHT_MARGIN,0,0], RIGHT)
+    # successor built by Tower.successive: {i, {i}}
+    def pair_successor(self, i):
+        return self.pair( i, self.singleton(i) )
 
-        for icon in self.icons:
-            icon.move_to(self.rect)
+    # subsets of a set, lazily (all the 2^n of them)
+    def subsets(self, i):
 
-        self.current_icon = self.icons[0]
-        scene.play( Create(self.rect), Create(self.current_icon) )
+        members = sorted(self.sets[i])
+        for mask in range( 2**len(members) ):
+            yield self.intern( 
+                m for b, m in enumerate(members) if (mask >> b) & 1 
+            )
 
+    def power_set(self, i):
+        return self.intern( self.subsets(i) )
 
-    def vibrate( self, instruments, level, subtowers = None ):
-        if self.current_icon is not None:
-            self.current_icon.set_opacity(self.off_opacity)
-        self.current_icon = self.icons[ instruments[0] ]
-        self.current_icon.set_opacity(1)
-        return [Wiggle(self.icons[instruments[0]], 1.2, 0.2, 4)]
+    # Lazy families: every set is interned once, so the memory grows 
+    # with the distinct sets and not with the size of the expanded towers.
 
-# base class for instrument players
-class InstrumentPlayer():
+    # start, function(start), function(function(start)), ...
+    def iterate(self, function, start = 0):
 
-    def __init__(self) -> None:
-        pass
+        i = start
+        while True:
+            yield i
+            i = function(i)
 
+    # von Neumann ordinals 0, 1 = {0}, 2 = {0, 1}, ...
+    def ordinals(self):
+        return self.iterate(self.successor)
 
-    def play_sound( self, level, subtowers_count ):
-        pass
+    # cumulative hierarchy V0 = {}, V(n+1) = P(Vn)
+    def cumulative_hierarchy(self):
+        return self.iterate(self.power_set)
 
-# Player that plays more instruments separately (ie: at the same time)
-class InstrumentSeparatePlayer( InstrumentPlayer ):
+    # number of blocks of the expanded tower of a set (memoized on the dag)
+    def expanded_size(self, i):
 
-    def __init__( 
-        self, scene, instruments, probabilities, gains, instrument_display,
-        use = "nesting", up = True                 
+        if i not in self.expanded_sizes:
+            self.expanded_sizes[i] = 1 + sum( 
+                self.expanded_size(m) for m in self.sets[i] 
+            )
+
+        return self.expanded_sizes[i]
+
+    # floors of the expanded tower of a set (memoized on the dag)
+    def depth(self, i):
+
+        if i not in self.depths:
+            self.depths[i] = 1 + max( self.depth(m) for m in self.sets[i] ) if len(self.sets[i]) > 0 else 0
+
+        return self.depths[i]
+
+    # id of the set represented by a tower
+    def of_tower(self, tower):
+
+        # a summary or collapsed block stands for its whole set (from another index, by string)
+        if tower.summary_set is not None:
+            sets, i = tower.summary_set
+            return i if sets is self else self.of_string( sets.to_string(i) )
+
+        if tower.subtowers is None:
+            return 0
+
+        return self.intern( self.of_tower(t) for t in tower.subtowers )
+
+    # id of the set represented by a bracket string (no recursion, for deep strings)
+    def of_string(self, string):
+
+        stack = []
+        result = None
+        for c in string:
+            if c in open_braces:
+                stack.append( set() )
+            elif c in close_braces:
+                i = self.intern( stack.pop() )
+                if len(stack) == 0:
+                    result = i
+                    break
+                stack[-1].add(i)
+
+        return result
+
+    # canonical bracket string of a set (members sorted by id)
+    def to_string(self, i, open = "(", close = ")"):
+
+        return open + "".join( 
+            self.to_string(m, open, close) for m in sorted(self.sets[i]) 
+        ) + close
+
+
+# default registry of canonical sets
+canonical_sets = CanonicalSets()
+
+
+
+# Edit script between two towers (towers as multisets: duplicates count). 
+# At every level, from the roots down, the children with the same structure 
+# (hash-consed ids) are paired directly; when one child is left on each side 
+# the two are paired and diffed the same way, and the other leftovers are 
+# matched by the constrained (unordered) tree edit distance, see constrained.
+# The work grows with the difference between the towers, not with their size.
+# The scripts are minimal on all the towers up to 5 blocks (see check); larger 
+# ones may split a forest under more inserted blocks than the script finds.
+# Labels are the colours of the blocks.
+class TreeEdit():
+
+    def __init__(self):
+        self.ids = {}           # id(tower) -> id of its structure
+        self.structures = {}    # sorted ids of the children -> id of the structure
+        self.pairs = []         # (block of the first tower, block of the second)
+        self.deleted = []       # blocks of the first tower only
+        self.inserted = []      # blocks of the second tower only
+        self.distance = 0       # deleted + inserted + relabelled
+        self.sizes = {}         # id(tower) -> blocks of its subtree
+        self.trees = {}         # (id, id) -> distance between two subtrees, and how
+        self.forests = {}       # (id, id) -> distance between their children, and how
+
+    def structure(self, tower):
+
+        if id(tower) not in self.ids:
+            key = tuple( sorted( self.structure(t) for t in Tower.children_of(tower) ) )
+            self.ids[id(tower)] = self.structures.setdefault( key, len(self.structures) )
+
+        return self.ids[id(tower)]
+
+    # children in canonical order (identical structures have the same order)
+    def children(self, tower):
+
+        return sorted( Tower.children_of(tower), key = self.structure )
+
+    # children left to right, the order of the tower (it does not change with their structure)
+    @staticmethod
+    def ordered(tower):
+
+        return Tower.children_of(tower)
+
+    @staticmethod
+    def label(tower):
+        return tower.rect.get_fill_color()
+
+    # same place, size and colour: nothing to animate
+    @staticmethod
+    def same_block(a, b):
+
+        return (
+            np.allclose( a.rect.get_center(), b.rect.get_center() ) 
+            and abs( a.rect.width - b.rect.width ) < 1e-6 
+            and abs( a.rect.height - b.rect.height ) < 1e-6
+            and TreeEdit.label(a) == TreeEdit.label(b)
+        )
+
+    # edit script from a to b (the roots are always paired)
+    def diff(self, a, b):
+
+        stack = [ (a, b) ]
+        while len(stack) > 0:
+            a, b = stack.pop()
+            if self.structure(a) == self.structure(b):
+                self.pair_identical(a, b)
+                continue
+
+            self.pair(a, b)
+
+            # children with the same structure are paired
+            pool = {}
+            for t in TreeEdit.ordered(b):
+                pool.setdefault( self.structure(t), [] ).append(t)
+
+            rest_a = []
+            for t in TreeEdit.ordered(a):
+                same = pool.get( self.structure(t) )
+                if same:
+                    self.pair_identical( t, same.pop(0) )
+                else:
+                    rest_a.append(t)
+
+            remaining = { id(t) for ts in pool.values() for t in ts }
+            rest_b = [ t for t in TreeEdit.ordered(b) if id(t) in remaining ]
+
+            # one changed child on each side: diffed in turn, the others go to constrained
+            if len(rest_a) == 1 and len(rest_b) == 1:
+                stack.append( (rest_a[0], rest_b[0]) )
+            elif len(rest_a) > 0 or len(rest_b) > 0:
+                self.constrained(a, rest_a, b, rest_b)
+
+        return self
+
+    def pair(self, a, b):
+
+        self.pairs.append( (a, b) )
+        if TreeEdit.label(a) != TreeEdit.label(b):
+            self.distance += 1
+
+    def pair_identical(self, a, b):
+
+        stack = [ (a, b) ]
+        while len(stack) > 0:
+            a, b = stack.pop()
+            self.pair(a, b)
+            stack += zip( self.children(a), self.children(b) )
+
+    # blocks of a subtree
+    def family(self, tower):
+
+        blocks = []
+        stack = [tower]
+        while len(stack) > 0:
+            t = stack.pop()
+            blocks.append(t)
+            stack += TreeEdit.ordered(t)
+
+        return blocks
+
+    def size(self, tower):
+
+        if id(tower) not in self.sizes:
+            self.sizes[id(tower)] = 1 + sum( self.size(t) for t in TreeEdit.ordered(tower) )
+
+        return self.sizes[id(tower)]
+
+    # Pairs, deletes and inserts the blocks of two forests with the minimum 
+    # constrained edit distance (Zhang 1996, unordered): disjoint subtrees go to 
+    # disjoint subtrees, the children of two paired blocks are matched by an 
+    # assignment, and a block can be inserted (or deleted) over a whole forest.
+    # (forest_a are children of a, forest_b of b)
+    def constrained(self, a, forest_a, b, forest_b):
+
+        deleted, inserted = len(self.deleted), len(self.inserted)
+        self.emit_forest( ("rest", id(a)), forest_a, ("rest", id(b)), forest_b )
+        self.distance += len(self.deleted) - deleted + len(self.inserted) - inserted
+
+    # distance between two subtrees, and how: ("pair",), ("insert", child of b)
+    # or ("delete", child of a)
+    def tree_distance(self, a, b):
+
+        key = ( id(a), id(b) )
+        if key not in self.trees:
+            children_a, children_b = TreeEdit.ordered(a), TreeEdit.ordered(b)
+            best = ( 
+                ( TreeEdit.label(a) != TreeEdit.label(b) ) 
+                + self.forest_distance( id(a), children_a, id(b), children_b )[0], 
+                ("pair",) 
+            )
+            for t in children_b:
+                cost = self.size(b) - self.size(t) + self.tree_distance(a, t)[0]
+                if cost < best[0]:
+                    best = ( cost, ("insert", t) )
+            for t in children_a:
+                cost = self.size(a) - self.size(t) + self.tree_distance(t, b)[0]
+                if cost < best[0]:
+                    best = ( cost, ("delete", t) )
+            self.trees[key] = best
+
+        return self.trees[key]
+
+    # distance between two forests (the children of key_a and key_b), and how: 
+    # ("match", [(tree of a or None, tree of b or None)]), ("insert", tree of b 
+    # over the forest of a) or ("delete", tree of a over the forest of b)
+    def forest_distance(self, key_a, forest_a, key_b, forest_b):
+
+        key = (key_a, key_b)
+        if key not in self.forests:
+            size_a = sum( self.size(t) for t in forest_a )
+            size_b = sum( self.size(t) for t in forest_b )
+
+            # assignment of the trees, a tree without partner is deleted or inserted
+            n, m = len(forest_a), len(forest_b)
+            if n == 0 or m == 0:
+                self.forests[key] = ( 
+                    size_a + size_b, 
+                    ( "match", [ (t, None) for t in forest_a ] + [ (None, u) for u in forest_b ] ) 
+                )
+                return self.forests[key]
+
+            never = size_a + size_b + 1
+            cost = [ [0]*(n+m) for _ in range(n+m) ]
+            for i, t in enumerate(forest_a):
+                cost[i][m:] = [never]*n
+                cost[i][m+i] = self.size(t)
+                for j, u in enumerate(forest_b):
+                    cost[i][j] = self.tree_distance(t, u)[0]
+            for j, u in enumerate(forest_b):
+                cost[n+j][:m] = [never]*m
+                cost[n+j][j] = self.size(u)
+            columns = TreeEdit.assignment(cost)
+            best = ( 
+                sum( cost[i][columns[i]] for i in range(n+m) ), 
+                ( "match", 
+                    [ ( forest_a[i], forest_b[columns[i]] if columns[i] < m else None ) for i in range(n) ]
+                    + [ (None, forest_b[j]) for j in range(m) if columns[n+j] == j ] 
+                ) 
+            )
+
+            if n > 0:
+                for u in forest_b:
+                    c = size_b - self.size(u) + 1 + self.forest_distance( key_a, forest_a, id(u), TreeEdit.ordered(u) )[0]
+                    if c < best[0]:
+                        best = ( c, ("insert", u) )
+            if m > 0:
+                for t in forest_a:
+                    c = size_a - self.size(t) + 1 + self.forest_distance( id(t), TreeEdit.ordered(t), key_b, forest_b )[0]
+                    if c < best[0]:
+                        best = ( c, ("delete", t) )
+            self.forests[key] = best
+
+        return self.forests[key]
+
+    # minimum cost assignment of a square matrix (Hungarian method, lists: 
+    # the matrices are the children of two blocks): the column of every row
+    @staticmethod
+    def assignment(cost):
+
+        n = len(cost)
+        u, v = [0]*(n+1), [0]*(n+1)
+        row_of = [0]*(n+1)         # column -> row (1 based, 0 free)
+        way = [0]*(n+1)
+        for i in range(1, n+1):
+            row_of[0] = i
+            j0 = 0
+            minimum = [inf]*(n+1)
+            used = [False]*(n+1)
+            while True:
+                used[j0] = True
+                i0 = row_of[j0]
+                row = cost[i0-1]
+                delta, j1 = inf, 0
+                for j in range(1, n+1):
+                    if not used[j]:
+                        current = row[j-1] - u[i0] - v[j]
+                        if current < minimum[j]:
+                            minimum[j], way[j] = current, j0
+                        if minimum[j] < delta:
+                            delta, j1 = minimum[j], j
+                for j in range(n+1):
+                    if used[j]:
+                        u[ row_of[j] ] += delta
+                        v[j] -= delta
+                    else:
+                        minimum[j] -= delta
+                j0 = j1
+                if row_of[j0] == 0:
+                    break
+            while j0 != 0:
+                j1 = way[j0]
+                row_of[j0] = row_of[j1]
+                j0 = j1
+
+        columns = [0]*n
+        for j in range(1, n+1):
+            columns[ row_of[j]-1 ] = j-1
+        return columns
+
+    # Minimum edit distance by brute force (tiny towers only): every one-to-one 
+    # mapping of the blocks that keeps the ancestors, with the roots paired,
+    # costs the unmapped blocks plus the mapped blocks of different colour.
+    @staticmethod
+    def brute_force_distance(a, b):
+
+        def blocks(tower):
+            found = []
+            stack = [ (tower, ()) ]
+            while len(stack) > 0:
+                t, ancestors = stack.pop()
+                found.append( (t, ancestors) )
+                stack += [ (c, ancestors + (len(found)-1,)) for c in TreeEdit.ordered(t) ]
+            return found
+
+        blocks_a, blocks_b = blocks(a), blocks(b)
+        best = [ len(blocks_a) + len(blocks_b) ]
+
+        def extend(x, mapping, used, cost):
+            if x == len(blocks_a):
+                best[0] = min( best[0], cost + len(blocks_a) + len(blocks_b) - 2*len(mapping) )
+                return
+
+            if x > 0:
+                extend(x+1, mapping, used, cost)
+            for y in ( range(len(blocks_b)) if x > 0 else [0] ):
+                if y in used:
+                    continue
+                if all( 
+                    (x2 in blocks_a[x][1]) == (y2 in blocks_b[y][1]) 
+                    and (x in blocks_a[x2][1]) == (y in blocks_b[y2][1])
+                    for x2, y2 in mapping 
+                ):
+                    relabel = TreeEdit.label(blocks_a[x][0]) != TreeEdit.label(blocks_b[y][0])
+                    extend(x+1, mapping + [(x, y)], used | {y}, cost + relabel)
+
+        extend(0, [], set(), 0)
+        return best[0]
+
+    # all the bracket strings of a number of blocks
+    @staticmethod
+    def strings(blocks):
+
+        def forests(n):
+            if n == 0:
+                yield ""
+                return
+            for k in range(1, n+1):
+                for first in TreeEdit.strings(k):
+                    for rest in forests(n-k):
+                        yield first + rest
+
+        return [ "(" + f + ")" for f in forests(blocks-1) ]
+
+    # Checks the edit scripts against brute force on all the pairs of towers up 
+    # to max_blocks blocks: the script must be a valid mapping of the blocks
+    # and its distance the minimum. Returns the failures [(string, string, distance, minimum)].
+    @staticmethod
+    def check(max_blocks = 5):
+
+        strings = [ string for n in range(1, max_blocks+1) for string in TreeEdit.strings(n) ]
+        towers = { string: Tower.from_string_bottom_up(string, 0, 7, 0.6, 0.2)[0] for string in strings }
+
+        failures = []
+        for sa in strings:
+            for sb in strings:
+                a, b = towers[sa], towers[sb]
+                edit = TreeEdit().diff(a, b)
+                blocks_a, blocks_b = edit.family(a), edit.family(b)
+                valid = (
+                    len(edit.pairs) + len(edit.deleted) == len(blocks_a)
+                    and len(edit.pairs) + len(edit.inserted) == len(blocks_b)
+                    and len( { id(x) for x, _ in edit.pairs } ) == len(edit.pairs)
+                    and len( { id(y) for _, y in edit.pairs } ) == len(edit.pairs)
+                )
+                minimum = TreeEdit.brute_force_distance(a, b)
+                if not valid or edit.distance != minimum:
+                    failures.append( (sa, sb, edit.distance, minimum) )
+
+        return failures
+
+    # applies the edit script of two forests (see forest_distance)
+    def emit_forest(self, key_a, forest_a, key_b, forest_b):
+
+        stack = [ ("forest", key_a, forest_a, key_b, forest_b) ]
+        while len(stack) > 0:
+            item = stack.pop()
+            if item[0] == "tree":
+                _, a, b = item
+                how = self.tree_distance(a, b)[1]
+                if how[0] == "pair":
+                    self.pair(a, b)
+                    stack.append( ("forest", id(a), TreeEdit.ordered(a), id(b), TreeEdit.ordered(b)) )
+                elif how[0] == "insert":
+                    kept = { id(t) for t in self.family(how[1]) }
+                    self.inserted += [ t for t in self.family(b) if id(t) not in kept ]
+                    stack.append( ("tree", a, how[1]) )
+                else:
+                    kept = { id(t) for t in self.family(how[1]) }
+                    self.deleted += [ t for t in self.family(a) if id(t) not in kept ]
+                    stack.append( ("tree", how[1], b) )
+                continue
+
+            _, key_a, forest_a, key_b, forest_b = item
+            how = self.forest_distance(key_a, forest_a, key_b, forest_b)[1]
+            if how[0] == "match":
+                for t, u in how[1]:
+                    if u is None:
+                        self.deleted += self.family(t)
+                    elif t is None:
+                        self.inserted += self.family(u)
+                    else:
+                        stack.append( ("tree", t, u) )
+            elif how[0] == "insert":
+                u = how[1]
+                self.inserted.append(u)
+                self.inserted += [ f for t in forest_b if t is not u for f in self.family(t) ]
+                stack.append( ("forest", key_a, forest_a, id(u), TreeEdit.ordered(u)) )
+            else:
+                t = how[1]
+                self.deleted.append(t)
+                self.deleted += [ f for u in forest_a if u is not t for f in self.family(u) ]
+                stack.append( ("forest", id(t), TreeEdit.ordered(t), key_b, forest_b) )
+
+
+
+
+# Rewrite rule on towers as sets, like "X -> (X)": every match gets a new base.
+# Patterns are bracket strings: a capital letter is a variable (any subtower, the
+# same one where it repeats), "R*" takes the remaining members of a set (and in 
+# the result puts them back as members), brackets without variables are literal sets.
+# With depth the rule only applies to the blocks at that depth (1: the members of 
+# the tower), otherwise to the outermost matches.
+# Matches are memoized by canonical id: equal subtowers are matched only once.
+class RewriteRule():
+
+    def __init__(self, lhs, rhs, depth = None, sets = None):
+
+        self.sets = canonical_sets if sets is None else sets
+        self.lhs = RewriteRule.parse(lhs)
+        self.rhs = RewriteRule.parse(rhs)
+        self.depth = depth
+        self.results = {}       # set id -> id of the rewritten set, None if no match
+
+        unbound = RewriteRule.variables(self.rhs) - RewriteRule.variables(self.lhs)
+        if len(unbound) > 0:
+            raise ValueError( "unbound variables: " + ", ".join( sorted(unbound) ) )
+
+    # ("var", name) | ("set", [patterns], name of the rest or None)
+    @staticmethod
+    def parse(pattern):
+
+        stack = [[]]
+        for token in re.findall( r"[A-Z]\*?|[\(\[\{<\)\]\}>]", pattern ):
+            if token in open_braces:
+                stack.append([])
+            elif token in close_braces:
+                if len(stack) < 2:
+                    raise ValueError("unbalanced pattern: " + pattern)
+                items = stack.pop()
+                rests = [ p[1] for p in items if p[0] == "rest" ]
+                if len(rests) > 1:
+                    raise ValueError("more rests in a set: " + pattern)
+                stack[-1].append( ( 
+                    "set", [ p for p in items if p[0] != "rest" ], rests[0] if rests else None 
+                ) )
+            elif token.endswith("*"):
+                stack[-1].append( ("rest", token[0]) )
+            else:
+                stack[-1].append( ("var", token) )
+
+        if len(stack) != 1 or len(stack[0]) != 1 or stack[0][0][0] == "rest":
+            raise ValueError("a pattern is one subtower: " + pattern)
+
+        return stack[0][0]
+
+    @staticmethod
+    def variables(pattern):
+
+        if pattern[0] == "var":
+            return { pattern[1] }
+
+        names = { pattern[2] } if pattern[2] is not None else set()
+        for p in pattern[1]:
+            names |= RewriteRule.variables(p)
+        return names
+
+    # bindings (variable -> set id) of the matches of a pattern on a set
+    def match(self, pattern, i, bindings):
+
+        if pattern[0] == "var":
+            name = pattern[1]
+            if name not in bindings:
+                yield { **bindings, name: i }
+            elif bindings[name] == i:
+                yield bindings
+            return
+
+        _, items, rest = pattern
+        members = self.sets.members(i)
+        if len(members) < len(items) or (rest is None and len(members) != len(items)):
+            return
+
+        yield from self.match_members( items, sorted(members), rest, bindings )
+
+    def match_members(self, items, members, rest, bindings):
+
+        if len(items) == 0:
+            if rest is None:
+                yield bindings
+                return
+            r = self.sets.intern(members)
+            if rest not in bindings:
+                yield { **bindings, rest: r }
+            elif bindings[rest] == r:
+                yield bindings
+            return
+
+        for k, m in enumerate(members):
+            for b in self.match( items[0], m, bindings ):
+                yield from self.match_members( items[1:], members[:k] + members[k+1:], rest, b )
+
+    # set id of a pattern with its variables bound
+    def build(self, pattern, bindings):
+
+        if pattern[0] == "var":
+            return bindings[ pattern[1] ]
+
+        _, items, rest = pattern
+        members = [ self.build(p, bindings) for p in items ]
+        if rest is not None:
+            members += list( self.sets.members( bindings[rest] ) )
+
+        return self.sets.intern(members)
+
+    # id of the set rewritten by the rule, None if it does not match
+    def apply(self, i):
+
+        if i not in self.results:
+            self.results[i] = None
+            for bindings in self.match(self.lhs, i, {}):
+                self.results[i] = self.build(self.rhs, bindings)
+                break
+
+        return self.results[i]
+
+
+
+# ---------------------------------
+
+# Static pictures of towers (svg or png) drawn without manim mobjects.
+# The layout is the one of Tower.from_string_bottom_up and set_and_resize_subtowers:
+# a child is built half wide and FLOOR_RATIO high, then the whole child tower is
+# scaled to fit the width left by SPACING. Here the scales are composed along the
+# path, so every block is computed in one walk of the string.
+# Memory: one int per block (the children counts) plus one frame per nesting level.
+class TowerSketch():
+
+    def __init__(
+        self, string, block_width = 2, block_height = 1, corner_radius = CORNER_RADIUS,
+        border_width = BORDER_WIDTH, color_type = 0
     ):
+        self.string = string
+        self.block_width = block_width
+        self.block_height = block_height
+        self.corner_radius = corner_radius
+        self.border_width = border_width
+        self.color_type = color_type
+
+        self.children = TowerSketch.count_children(string)
+
+        # colors by level, as hex strings
+        self.colors = [ 
+            ManimColor( Tower.select_color_by_level(level, color_type) ).to_hex() 
+            for level in range(10) 
+        ]
+        self.empty_color = ManimColor(EMPY_SET_COLOR).to_hex()
+        self.border_color = ManimColor(BORDER_COLOR).to_hex()
+
+    # tower string of a source: a file, "-" for stdin, or the string itself
+    # (a command line argument is limited to 128 KB, big towers come from files)
+    @staticmethod
+    def read( source ):
+
+        if source == "-":
+            return sys.stdin.read()
+
+        if os.path.isfile(source):
+            with open(source, encoding = "utf-8") as f:
+                return f.read()
+
+        return source
+
+    # number of children of every block, in order of open braces
+    @staticmethod
+    def count_children( string ):
+
+        children = array("i")
+        stack = []
+        for c in string:
+            if c in open_braces:
+                if len(stack)>0:
+                    children[stack[-1]] += 1
+                stack.append( len(children) )
+                children.append(0)
+            elif c in close_braces:
+                stack.pop()
+
+        return children
+
+    # color of a block
+    def block_color( self, level, children ):
+
+        if children == 0:
+            return self.empty_color
+
+        return self.colors[ min(level, len(self.colors)-1) ]
+
+    # yields the blocks (left, bottom, width, height, corner radius, color)
+    # with the root centered in the origin, as from_string_bottom_up builds it
+    def blocks( self ):
+
+        # frame: [left, bottom, height, scale, level, children, next child, child width]
+        stack = []
+        k = 0
+        for c in self.string:
+            if c in close_braces:
+                stack.pop()
+                continue
+            if c not in open_braces:
+                continue
+
+            n = self.children[k]
+            k += 1
+
+            if len(stack) == 0:
+                level = 0
+                scale = 1
+                left = -self.block_width/2
+                bottom = -self.block_height/2
+                width = self.block_width
+            else:
+                p = stack[-1]
+                level = p[4] + 1
+                scale = p[3] * p[7] / ( self.block_width * 0.5**level )
+                left = p[0] + p[3] * ( SPACING + p[6] * (p[7]+SPACING) )
+                bottom = p[1] + p[2]
+                width = p[3] * p[7]
+                p[6] += 1
+
+            height = scale * self.block_height * FLOOR_RATIO**level
+            radius = scale * self.corner_radius * CORNER_RATIO**level
+
+            # width of the children in the frame of this block (before its scale)
+            child_width = 0
+            if n>0:
+                child_width = max( 0, ( self.block_width * 0.5**level - (n+1)*SPACING ) / n )
+
+            stack.append( [left, bottom, height, scale, level, n, 0, child_width] )
+
+            yield left, bottom, width, height, radius, self.block_color(level, n)
+
+    # sizes of every block, in order of open braces: array of 
+    # (width, height, height of the block with its subtowers) triples
+    def extents( self ):
+
+        extents = array("d")
+        blocks = self.blocks()
+        # stack of [block index, bottom, top of the subtower]
+        stack = []
+        for c in self.string:
+            if c in open_braces:
+                left, bottom, width, height, radius, color = next(blocks)
+                stack.append( [len(extents)//3, bottom, bottom+height] )
+                extents.extend( [width, height, height] )
+            elif c in close_braces:
+                k, bottom, top = stack.pop()
+                extents[3*k+2] = top-bottom
+                if len(stack)>0 and top>stack[-1][2]:
+                    stack[-1][2] = top
+
+        return extents
+
+    # bounding box of the tower (left, bottom, right, top)
+    def bounding_box( self ):
+
+        box = [ -self.block_width/2, -self.block_height/2, self.block_width/2, -self.block_height/2 ]
+        for left, bottom, width, height, radius, color in self.blocks():
+            if bottom+height>box[3]:
+                box[3] = bottom+height
+
+        return box
+
+    # writes an svg file
+    def save_svg( self, path, margin = 0.1 ):
+
+        left, bottom, right, top = self.bounding_box()
+        stroke = self.border_width * 0.01
+
+        with open(path, "w", encoding = "utf-8") as f:
+            f.write(
+                '<svg xmlns="http://www.w3.org/2000/svg" viewBox="%.6g %.6g %.6g %.6g">\n' % (
+                    left-margin, -top-margin, right-left+2*margin, top-bottom+2*margin
+                )
+            )
+            f.write(
+                '<g stroke="%s" stroke-width="%.6g">\n' % (self.border_color, stroke) 
+            )
+            for x, y, w, h, r, color in self.blocks():
+                f.write(
+                    '<rect x="%.6g" y="%.6g" width="%.6g" height="%.6g" rx="%.6g" fill="%s"/>\n' % (
+                        x, -y-h, w, h, r, color
+                    )
+                )
+            f.write('</g>\n</svg>\n')
+
+        return path
+
+    # writes a png file through cairo, blocks smaller than min_size pixels are skipped
+    def save_png( self, path, pixel_width = 1280, margin = 0.1, min_size = 0.25 ):
+
+        left, bottom, right, top = self.bounding_box()
+        unit = pixel_width / (right-left+2*margin)
+        pixel_height = max( 1, int( (top-bottom+2*margin)*unit ) )
+
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, pixel_width, pixel_height)
+        ctx = cairo.Context(surface)
+        ctx.set_line_width( self.border_width * 0.01 * unit )
+
+        for x, y, w, h, r, color in self.blocks():
+            if w*unit<min_size or h*unit<min_size:
+                continue
+
+            px = (x-left+margin) * unit
+            py = (top+margin-y-h) * unit
+            TowerSketch.rounded_rectangle( ctx, px, py, w*unit, h*unit, r*unit )
+            ctx.set_source_rgb( *TowerSketch.hex_to_rgb(color) )
+            ctx.fill_preserve()
+            ctx.set_source_rgb( *TowerSketch.hex_to_rgb(self.border_color) )
+            ctx.stroke()
+
+        surface.write_to_png(path)
+
+        return path
+
+    @staticmethod
+    def rounded_rectangle( ctx, x, y, w, h, r ):
+
+        r = min( r, w/2, h/2 )
+        ctx.new_sub_path()
+        ctx.arc( x+w-r, y+r, r, -PI/2, 0 )
+        ctx.arc( x+w-r, y+h-r, r, 0, PI/2 )
+        ctx.arc( x+r, y+h-r, r, PI/2, PI )
+        ctx.arc( x+r, y+r, r, PI, 3*PI/2 )
+        ctx.close_path()
+
+    @staticmethod
+    def hex_to_rgb( color ):
+
+        color = color.lstrip("#")
+        return [ int(color[i:i+2], 16)/255 for i in (0, 2, 4) ]
+
+
+
+
+# ---------------------------------
+
+# Streaming statistics of a bracket string: checks that it is well formed and counts
+# depth, blocks, maximum number of children and empty sets without building towers.
+# Data is fed in chunks (str or bytes), the memory is one small frame per nesting level.
+# Positions are offsets in bytes (utf-8 for str input).
+class TowerStats():
+
+    open_codes = { ord(c) for c in open_braces }
+    close_codes = { ord(c): ord(matching_braces[c]) for c in close_braces }
+    space_codes = { ord(c) for c in " \t\r\n" }
+
+    # kind of every byte: 1 open brace, -1 close brace, 0 space, 2 anything else
+    kinds = np.full(256, 2, dtype = np.int8)
+    kinds[ list(open_codes) ] = 1
+    kinds[ list(close_codes) ] = -1
+    kinds[ list(space_codes) ] = 0
+
+    # open brace matching every close brace (the other bytes map to themselves)
+    partners = np.arange(256, dtype = np.uint8)
+    partners[ list(close_codes.keys()) ] = list(close_codes.values())
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.nodes = 0
+        self.max_children = 0
+        self.empty_sets = 0
+        self.towers = 0
+        self.error = None
+        self.error_position = None
+
+        self.position = 0
+        # open blocks, one per nesting level: brace codes and counts of the closed children
+        self.stack_codes = np.zeros(0, dtype = np.uint8)
+        self.stack_counts = np.zeros(0, dtype = np.int64)
+
+    def is_valid(self):
+        return self.error is None and self.towers == 1
+
+    def set_error(self, message, position):
+        self.error = message
+        self.error_position = position
+
+    # Feeds a chunk of the string, returns False once an error has been found.
+    # The chunk is scanned with numpy: the depths are the cumulative sum of the braces,
+    # and the braces are grouped by depth after them (one stable sort). In a group,
+    # an open brace is followed by the close braces of its children; and the open 
+    # braces of a level pair in order with the close braces back to the level below.
+    # Only a chunk with an error is scanned again byte by byte (see feed_bytes), 
+    # to find where it is.
+    def feed(self, chunk):
+
+        if self.error is not None:
+            return False
+
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+
+        codes = np.frombuffer(chunk, dtype = np.uint8)
+        kinds = TowerStats.kinds[codes]
+        if np.any(kinds == 2):
+            return self.feed_bytes(chunk)
+
+        positions = np.flatnonzero(kinds)
+        if len(positions) == 0:
+            self.position += len(chunk)
+            return True
+
+        steps = kinds[positions]
+        depth = len(self.stack_codes)
+        after = np.cumsum(steps, dtype = np.int64) + depth
+        opens = steps > 0
+
+        roots = np.count_nonzero( opens & (after == 1) )
+        if after.min() < 0 or self.towers + roots > 1:
+            return self.feed_bytes(chunk)
+
+        # the open blocks of the stack (levels 1..depth) come before the braces of the chunk
+        after = np.concatenate( [ np.arange(1, depth+1), after ] )
+        braces = np.concatenate( [ self.stack_codes, codes[positions] ] )
+        opens = np.concatenate( [ np.ones(depth, dtype = bool), opens ] )
+
+        order = TowerStats.group_order(after)
+        sorted_opens = opens[order]
+        open_index = order[sorted_opens]            # by level
+        close_index = order[~sorted_opens]          # by level of the closed block
+
+        # a level left open (at the end of the chunk) shifts the pairs of the levels above
+        end = int(after[-1])
+        ranks = np.arange(len(close_index)) + np.minimum( after[close_index], end )
+        matches = open_index[ranks]
+        if np.any( braces[matches] != TowerStats.partners[ braces[close_index] ] ):
+            return self.feed_bytes(chunk)
+
+        # children: the close braces between an open brace and the next one in order
+        open_positions = np.flatnonzero(sorted_opens)
+        children = np.diff( np.append(open_positions, len(order)) ) - 1
+        stacked = open_index < depth
+        children[stacked] += self.stack_counts[ open_index[stacked] ]
+
+        closed = children[ranks]
+        self.empty_sets += int( np.count_nonzero(closed == 0) )
+        if len(closed) > 0:
+            self.max_children = max( self.max_children, int(closed.max()) )
+
+        self.nodes += len(open_index) - depth
+        self.towers += int(roots)
+        self.depth = max( self.depth, int(after.max()) )
+
+        left = np.ones( len(open_index), dtype = bool )
+        left[ranks] = False
+        self.stack_codes = braces[ open_index[left] ]
+        self.stack_counts = children[left]
+
+        self.position += len(chunk)
+        return True
+
+    # stable order of the indices by value (radix sort for small values)
+    @staticmethod
+    def group_order(values):
+
+        if values.max() < 1<<16:
+            values = values.astype(np.uint16)
+
+        return np.argsort(values, kind = "stable")
+
+    # feeds a chunk byte by byte (stops at the first error)
+    def feed_bytes(self, chunk):
+
+        # here the children are counted when they open: every open block but the last has one more
+        stack = [ [c, k+1] for c, k in zip( self.stack_codes.tolist(), self.stack_counts.tolist() ) ]
+        if len(stack)>0:
+            stack[-1][1] -= 1
+        open_codes = TowerStats.open_codes
+        close_codes = TowerStats.close_codes
+        space_codes = TowerStats.space_codes
+
+        position = self.position
+        result = True
+        for c in chunk:
+            if c in open_codes:
+                if len(stack) == 0:
+                    if self.towers>0:
+                        self.set_error("more than one tower", position)
+                        result = False
+                        break
+                    self.towers += 1
+                else:
+                    stack[-1][1] += 1
+                stack.append( [c, 0] )
+                self.nodes += 1
+                if len(stack)>self.depth:
+                    self.depth = len(stack)
+
+            elif c in close_codes:
+                if len(stack) == 0:
+                    self.set_error("unexpected " + chr(c), position)
+                    result = False
+                    break
+                frame = stack.pop()
+                if frame[0] != close_codes[c]:
+                    self.set_error( chr(frame[0]) + " closed by " + chr(c), position )
+                    result = False
+                    break
+                if frame[1] == 0:
+                    self.empty_sets += 1
+                elif frame[1]>self.max_children:
+                    self.max_children = frame[1]
+
+            elif c not in space_codes:
+                self.set_error("unexpected character " + repr(chr(c)), position)
+                result = False
+                break
+
+            position += 1
+
+        self.position = position
+        self.stack_codes = np.array( [ f[0] for f in stack ], dtype = np.uint8 )
+        self.stack_counts = np.array( [ f[1]-1 for f in stack ], dtype = np.int64 )
+        if len(stack)>0:
+            self.stack_counts[-1] += 1
+        return result
+
+    # end of the input, returns self
+    def finish(self):
+
+        if self.error is None:
+            if len(self.stack_codes)>0:
+                self.set_error( str(len(self.stack_codes)) + " braces not closed", self.position )
+            elif self.towers == 0:
+                self.set_error("no tower", self.position)
+
+        return self
+
+    @staticmethod
+    def from_string(string, chunk_size = 1<<20):
+
+        stats = TowerStats()
+        for i in range(0, len(string), chunk_size):
+            if not stats.feed( string[i:i+chunk_size] ):
+                break
+
+        return stats.finish()
+
+    # reads the file in chunks (or through mmap)
+    @staticmethod
+    def from_file(path, chunk_size = 1<<20, use_mmap = False):
+
+        stats = TowerStats()
+        with open(path, "rb") as f:
+            if use_mmap and os.path.getsize(path)>0:
+                with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as m:
+                    for i in range(0, len(m), chunk_size):
+                        if not stats.feed( m[i:i+chunk_size] ):
+                            break
+            else:
+                chunk = f.read(chunk_size)
+                while len(chunk)>0 and stats.feed(chunk):
+                    chunk = f.read(chunk_size)
+
+        return stats.finish()
+
+    def as_dict(self):
+        return {
+            "valid": self.is_valid(), "depth": self.depth, "nodes": self.nodes,
+            "max_children": self.max_children, "empty_sets": self.empty_sets,
+            "error": self.error, "error_position": self.error_position,
+        }
+
+
+
+
+# ---------------------------------
+
+# base class for instrument displays (they implement vibrate)
+class InstrumentDisplay():
+
+    def __init__(self, instruments, colors) -> None:
+        self.icons = []
+
+        for i in range(len(instruments)):
+            self.icons.append( self.get_icon(instruments[i], colors[i]) )
+
+    def get_icon(self, instrument, color = None):
+
+        if color is not None:
+            instrument.icon.set_color(color)
+
+        return instrument.icon
+
+    
+    def vibrate( self, instruments, level, subtowers = None ):
+        pass
+
+# display with separate instruments
+class InstrumentSeparateDisplay(InstrumentDisplay):
+
+    def __init__(
+            self, scene, instruments, colors, on_opacities, off_opacities
+    ) -> None:
+        super().__init__(instruments, colors)
+
         self.scene = scene
         self.instruments = instruments
-        self.probabilities = probabilities
-        self.instrument_display = instrument_display
-        self.up = up
-        self.use = use
-        self.gains = gains
+        self.colors = colors
+        self.on_opacities = on_opacities
+        self.off_opacities = off_opacities
+        self.instrument_count = len(instruments)
+
+        self.rect = RoundedRectangle(
+            width=self.instrument_count, height=1, corner_radius=0.3, 
+            color=BORDER_COLOR, stroke_width=2
+        )
+        self.rect.move_to([0,TOP_MARGIN-DISPLAY_HEIGHT,0])
+        self.rect.align_to([RIGHT_MARGIN,0,0], RIGHT)
+
+        scene.add( scene.static(self.rect) ) 
+        for i in range(len(self.icons)):
+            self.icons[i].move_to([RIGHT_MARGIN-DISPLAY_WIDTH/2-i, self.rect.get_center()[1], 0])
+            scene.add( self.icons[i] ) 
+            self.icons[i].set_opacity(0)
+
     
-    def play_sound( self, level, subtowers_count ):
+    def vibrate( self, indices, level, subtowers = None ):
+        for i in range(len(self.instruments)):
+            if i in indices:
+                self.icons[i].set_opacity(self.on_opacities[i])
+            else:
+                self.icons[i].set_opacity(self.off_opacities[i])
+
+        return [
+            Wiggle(self.icons[index], 1.2, 0.2, 4) for index in indices
+        ]
+
+# display that alternates instruments
+class InstrumentAlternateDisplay(InstrumentDisplay):
+
+    def __init__(self, scene, instruments, colors, off_opacity=0.1 ) -> None:
+        super().__init__(instruments, colors)
+
+        self.scene = scene
+        self.instruments = instruments
+        self.colors = colors
+        self.current_icon = None
+        self.off_opacity = off_opacity
+
+        self.rect = RoundedRectangle(
+            width=1, height=1, corner_radius=0.3, color=BORDER_COLOR, stroke_width=2
+        )
+        self.rect.move_to([0,TOP_MARGIN-DISPLAY_HEIGHT,0])
+        self.rect.align_to([RIGHT_MARGIN,0,0], RIGHT)
+
+        for icon in self.icons:
+            icon.move_to(self.rect)
+
+        self.current_icon = self.icons[0]
+        scene.static(self.rect)
+        scene.play( Create(self.rect), Create(self.current_icon) )
+
+
+    def vibrate( self, instruments, level, subtowers = None ):
+        if len(instruments) == 0:
+            return []
+
+        if self.current_icon is not None:
+            self.current_icon.set_opacity(self.off_opacity)
+        self.current_icon = self.icons[ instruments[0] ]
+        self.current_icon.set_opacity(1)
+        return [Wiggle(self.icons[instruments[0]], 1.2, 0.2, 4)]
+
+# Instrument choices of all the events of a planned tower build, drawn at once.
+# Row i is the i-th play_sound: level, children, note and the instruments playing.
+class EventTable():
+
+    def __init__(self, levels, children, notes, selected):
+        self.levels = levels
+        self.children = children
+        self.notes = notes
+        self.selected = selected        # bool matrix: events x instruments
+        self.next = 0
+
+    def __len__(self):
+        return len(self.levels)
+
+    # instruments of the next event, None when the table is over
+    def pop(self):
+        if self.next >= len(self):
+            return None
+
+        row = self.selected[self.next]
+        self.next += 1
+        return [ int(i) for i in np.flatnonzero(row) ]
+
+
+# base class for instrument players
+class InstrumentPlayer():
+
+    table = None        # planned events, see plan
+
+    def __init__(self) -> None:
+        pass
+
+
+    def play_sound( self, level, subtowers_count ):
+        pass
+
+    # draws the instruments of all the events [(level, children)] at once;
+    # play_sound reads them from the table until it is over
+    def plan( self, events ):
+
+        events = np.array( events, dtype = int ).reshape(-1, 2)
+        rng = np.random.default_rng( random.getrandbits(32) )
+        notes = events[:, 0] if self.use == "nesting" else events[:, 1]
+
+        self.table = EventTable( 
+            events[:, 0], events[:, 1], notes, self.draw( rng, len(events) ) 
+        )
+        return self.table
+
+    # instruments of the next planned event, None without a plan
+    def planned(self):
+        if self.table is None:
+            return None
+
+        return self.table.pop()
+
+# Player that plays more instruments separately (ie: at the same time)
+class InstrumentSeparatePlayer( InstrumentPlayer ):
+
+    def __init__( 
+        self, scene, instruments, probabilities, gains, instrument_display,
+        use = "nesting", up = True                 
+    ):
+        self.scene = scene
+        self.instruments = instruments
+        self.probabilities = probabilities
+        self.instrument_display = instrument_display
+        self.up = up
+        self.use = use
+        self.gains = gains
+
+    # every instrument plays with its probability
+    def draw( self, rng, n ):
+        return rng.random( (n, len(self.instruments)) ) < np.array(self.probabilities)
+    
+    def play_sound( self, level, subtowers_count ):
+
+        selected = self.planned()
+
+        if selected is None:
+            selected = []
+            for i in range(len(self.instruments)):
+                if random.random()<self.probabilities[i]:
+                    selected.append(i)
+
+        if self.use == "nesting":         
+            note = level
+        else: 
+            note = subtowers_count
+
+        for i in range(len(selected)):
+            self.scene.add_note( self.instruments[selected[i]], note, self.gains[selected[i]] )
+
+        return selected
+
+
+# Player that plays instruments alternatively    
+class InstrumentAlternatePlayer( InstrumentPlayer ):
+
+    def __init__( 
+        self, scene, instruments, probabilities, gains, instrument_display, 
+        use = "nesting", up=True 
+    ):
+
+        self.scene = scene
+        self.instruments = instruments
+        self.probabilities = probabilities
+        self.instrument_display = instrument_display
+        self.up = up
+        self.use = use
+        self.gains = gains
+
+    
+    # select instrument: probabilities summing to less than 1 are renormalized
+    # (every event plays one), the first instrument when they are all 0
+    def select_instrument(self):
+        r = random.random() * min( sum(self.probabilities), 1 )
+        total = 0
+        for i in range(len(self.probabilities)):
+            total += self.probabilities[i]
+            if total>r:
+                return i
+        
+        return 0
+
+    # one instrument per event, as select_instrument
+    def draw( self, rng, n ):
+
+        k = len(self.instruments)
+        cumulative = np.cumsum(self.probabilities)
+        if cumulative[-1] <= 0:
+            chosen = np.zeros( n, dtype = int )
+        else:
+            chosen = np.searchsorted( 
+                cumulative, rng.random(n) * min( cumulative[-1], 1 ), side = "right" 
+            )
+            chosen = np.minimum( chosen, k - 1 )
+
+        selected = np.zeros( (n, k), dtype = bool )
+        selected[np.arange(n), chosen] = True
+
+        return selected
+    
+
+    def play_sound( self, level, subtowers_count ):
+
+        selected = self.planned()
+        if selected is None:
+            selected = [ self.select_instrument() ]
+
+        if self.use == "nesting":
+            note = level
+        else: 
+            note = subtowers_count
+
+        for i in selected:
+            self.scene.add_note( self.instruments[i], note, self.gains[i] )
+
+        return selected
+    
+    
+    
+# Cache of Text mobjects, by (string, font, size, colour).
+# Building a Text means a pango layout and an svg parse, copying a cached one is 
+# much cheaper. The least recently used texts are evicted beyond max_size.
+class TextCache():
+
+    max_size = 256
+    texts = OrderedDict()
+
+    # a copy of the cached text (to be moved freely)
+    @staticmethod
+    def text( string, color = WHITE, font_size = DEFAULT_FONT_SIZE, font = "" ):
+
+        key = ( string, font, font_size, ManimColor(color).to_hex() )
+        cached = TextCache.texts.get(key)
+        if cached is None:
+            cached = Text(string, color = color, font_size = font_size, font = font)
+            TextCache.texts[key] = cached
+            if len(TextCache.texts)>TextCache.max_size:
+                TextCache.texts.popitem(last = False)
+        else:
+            TextCache.texts.move_to_end(key)
+
+        return cached.copy()
+
+    @staticmethod
+    def clear():
+        TextCache.texts = OrderedDict()
+
+
+
+# base class for displays (they implement update)
+class TowerAppDisplay():
+
+    def __init__(self) -> None:
+        pass
+
+    def update(self, level = None, subtowers = None, rule = None):
+        pass
+
+# null display
+class NullDisplay():
+
+    def __init__(self, scene) -> None:
+        self.scene = scene
+        return
+
+    def update(self, level = None, subtowers = None, rule = None):
+        return []
+
+# display for level
+class LevelDisplay(TowerAppDisplay):
+
+    def __init__(self, scene) -> None:
+        
+        self.scene = scene
+        self.rect = RoundedRectangle(
+            width=DISPLAY_WIDTH, height=DISPLAY_HEIGHT, 
+            corner_radius=0.3, color=BORDER_COLOR, stroke_width=2
+        )
+        self.rect.move_to([0,TOP_MARGIN - DISPLAY_HEIGHT*2 - DISPLAY_SPACING,0])
+        self.rect.align_to([RIGHT_MARGIN,0,0], RIGHT)
+        scene.add( scene.static(self.rect) )
+        lvl = TextCache.text("lvl", font_size = 14, color = BLUE).move_to(self.rect)
+        lvl.align_to([0,self.rect.get_top()[1]-0.05,0], UP)
+        scene.add( scene.static(lvl) )
+
+        self.value = "."
+        self.num = TextCache.text(self.value).move_to(self.rect)
+
+    def update(self, level = None, subtowers = None, rule = None):            
+
+        self.value = level
+        self.tmp = self.num
+        self.num = TextCache.text(str(level), color=Tower.select_color_by_level(level))
+        if level == -1:
+            self.num = TextCache.text(str("∞"), color=Tower.select_color_by_level(1))
+        self.num.move_to(self.rect) 
+        
+        return [ReplacementTransform(self.tmp, self.num)]
+    
+# display for number of subtowers
+class SubtowersDisplay(TowerAppDisplay):
+
+    def __init__(self, scene) -> None:
+        
+        self.scene = scene
+        self.rect = RoundedRectangle(
+            width=DISPLAY_WIDTH, height=DISPLAY_HEIGHT, 
+            corner_radius=0.3, color=BORDER_COLOR, stroke_width=2
+        )
+        self.rect.move_to([0,TOP_MARGIN - DISPLAY_HEIGHT*3 - DISPLAY_SPACING*2,0])
+        self.rect.align_to([RIGHT_MARGIN,0,0], RIGHT)
+        scene.add( scene.static(self.rect) )
+        chd = TextCache.text("children", font_size = 14, color = BLUE).move_to(self.rect)
+        chd.align_to([0,self.rect.get_top()[1]-0.05,0], UP)
+        scene.add( scene.static(chd) )
+
+        self.value = "."
+        self.num = TextCache.text(self.value).move_to(self.rect)
+
+    def update(self, level = None, subtowers = None, rule = None):            
+
+        self.value = level
+        self.tmp = self.num
+        self.num = TextCache.text(str(subtowers), color=Tower.select_color_by_level(subtowers))
+        self.num.move_to(self.rect) 
+        
+        return [ReplacementTransform(self.tmp, self.num)]
+
+# display for rule being used
+class RuleDisplay(TowerAppDisplay):
+
+    def __init__(self, scene, title = None, subtitle = None, blocks = 5) -> None:
+
+        if title is None and subtitle is None:
+            return
+        
+        self.scene = scene
+        self.rect = RoundedRectangle(
+            width=DISPLAY_WIDTH*blocks, height=DISPLAY_HEIGHT, 
+            corner_radius=0.3, color=BORDER_COLOR, stroke_width=2
+        )
+        self.rect.move_to([0,TOP_MARGIN - DISPLAY_HEIGHT,0])
+        self.rect.align_to([LEFT_MARGIN,0,0], LEFT)
+        scene.add( scene.static(self.rect) )
+
+        # titles depend on the locale
+        if title is not None:
+            txt = Text(scene.tr(title), color = YELLOW, font_size = 18).move_to(self.rect)
+            # txt.stretch_to_fit_width(DISPLAY_WIDTH*3)
+            txt.align_to([self.rect.get_left()[0]+0.3,0], LEFT)
+            txt.align_to([0,self.rect.get_top()[1]-0.05,0], UP)
+            scene.add( scene.static( scene.overlay(txt) ) )
+
+        self.rule = scene.tr(subtitle)
+        txt2 = Text(self.rule, color = YELLOW)
+        # txt2.stretch_to_fit_width(DISPLAY_WIDTH*2)
+        txt2.align_to([self.rect.get_left()[0]+0.4,0], LEFT)
+        txt2.align_to([0,self.rect.get_bottom()[1]+0.1,0], DOWN)
+        self.txt2 = txt2
+        scene.add( scene.static( scene.overlay(txt2) ) )
+
+    def update(self, level = None, subtowers = None, rule = None):            
+        return []
+
+
+# Persistent rope of expression tokens (token, colour).
+# Nodes are never changed: a concatenation shares its parts, 
+# so a snapshot of an expression is just a reference to its rope.
+class ExpressionRope():
+
+    def __init__(self, left = None, right = None, token = None, color = None) -> None:
+        self.left = left
+        self.right = right
+        self.token = token
+        self.color = color
+
+        if token is not None:
+            self.length = 1
+        else:
+            self.length = left.length + right.length
+
+    # concatenation of ropes (None are skipped), None if all are empty
+    @staticmethod
+    def concat( *ropes ):
+
+        result = None
+        for r in ropes:
+            if r is None:
+                continue
+            if result is None:
+                result = r
+            else:
+                result = ExpressionRope(result, r)
+
+        return result
+
+    # the last count tokens, as (token, colour) pairs in order
+    def last_tokens( self, count ):
+
+        tokens = []
+        stack = [self]
+        while len(stack)>0 and len(tokens)<count:
+            node = stack.pop()
+            if node.token is not None:
+                tokens.append( (node.token, node.color) )
+            else:
+                stack.append(node.left)
+                stack.append(node.right)
+
+        tokens.reverse()
+        return tokens
+
+    def to_string( self ):
+
+        return "".join( token for token, color in self.last_tokens(self.length) )
+
+
+# display for the expression of the set (or tower).
+# The expression is a rope of tokens, only the last tokens that fit in the box 
+# are mobjects, so the display follows the end of the expression while it grows.
+class ExpressionDisplay():
+
+    def __init__(self, scene, blocks = 10, max_tokens = 64) -> None:
+
+        self.scene = scene
+        self.rect = RoundedRectangle(
+            width=DISPLAY_WIDTH*blocks, height=DISPLAY_HEIGHT, 
+            corner_radius=0.3, color=BORDER_COLOR, stroke_width=2
+        )
+        self.rect.move_to([0, BOTTOM_MARGIN + DISPLAY_HEIGHT,0])
+        self.max_tokens = max_tokens
+        self.rope = None
+        self.expr_mobj = VGroup().move_to(self.rect)
+        scene.add( scene.static(self.rect) )
+
+    # adds a token at the end (or at the beginning with dir LEFT), returns its rope
+    def update(self, token = None, dir = RIGHT, color = BLUE):            
+        if token is not None:
+            leaf = ExpressionRope( token = token, color = color )
+            if np.array_equal(dir, LEFT):
+                self.rope = ExpressionRope.concat( leaf, self.rope )
+            else:
+                self.rope = ExpressionRope.concat( self.rope, leaf )
+    
+            self.display_expression()
+
+            return leaf
+    
+    # shows the last tokens that fit in the box (centered if the whole expression fits)
+    def display_expression(self):
+
+        self.scene.remove( self.expr_mobj )
+        self.expr_mobj = VGroup()
+
+        if self.rope is None:
+            return
+
+        available = self.rect.width - 2*self.rect.corner_radius
+        width = -MED_SMALL_BUFF
+        tokens = []
+        for token, color in reversed( self.rope.last_tokens(self.max_tokens) ):
+            t = TextCache.text(token, color = color)
+            if width + MED_SMALL_BUFF + t.width > available:
+                break
+            width += MED_SMALL_BUFF + t.width
+            tokens.append(t)
+
+        tokens.reverse()
+        self.expr_mobj.add( *tokens )
+        self.expr_mobj.arrange( RIGHT, buff = MED_SMALL_BUFF ).move_to( self.rect )
+        if len(tokens)<self.rope.length:
+            self.expr_mobj.align_to( [self.rect.get_right()[0]-self.rect.corner_radius, 0, 0], RIGHT )
+
+        self.scene.add( self.expr_mobj )
+
+    # snapshot of the expression (by reference)
+    def copy_state(self):
+        return self.rope
+
+    # back to old_state, then adds token1, the new expressions and token2,
+    # returns the rope of what has been added
+    def reset_state( self, old_state, token1, new_expressions, token2, color ):
+
+        updated_new_expr = ExpressionRope.concat( 
+            ExpressionRope( token = token1, color = color ),
+            *new_expressions,
+            ExpressionRope( token = token2, color = color ),
+        )
+        self.rope = ExpressionRope.concat( old_state, updated_new_expr )
+
+        self.display_expression()
+
+        return updated_new_expr
+        
+
+
+
+
+        
+        
+
+
+
+# Earth object where towers lie
+class Earth(VGroup):
+
+    def __init__(self, level, minx, maxx) -> None:
+        super().__init__()
+        self.level = level
+        self.minx = minx
+        self.maxx = maxx
+        self.line = Line([minx, level, 0], [maxx, level, 0])        
+        self.add(self.line)
+
+    def get_level(self):
+        return self.level
+
+    def get_minx(self):
+        return self.minx
+
+    def get_maxx(self):
+        return self.maxx
+
+    def vibrate(self, scale = 1.15, angle = 0.02, level = None, subtowers = None, rule = None):
+        return [Wiggle(self.line, scale_value=scale ,rotation_angle=angle)]
+
+# Scales and Progressions
+C_Major_Scale = ["C", "D", "E", "F", "G", "A", "B", "C2"]
+E_Major_Scale = ["E", "Fs", "G#", "A", "B", "C2s", "D2s", "E2"]
+Pentatonic_Scale = ["Cs", "Ds", "Fs", "Gs", "As" ]
+Choords_1451 = [ ["C", "E", "G"], ["F", "A", "C"], ["G", "B", "D"], ["C", "E", "G"] ]
+Diatonic_Scale = [ "F", "C", "G", "D", "F", "A", "E", "B"]
+
+# Std scale used as default
+Std_Scale = C_Major_Scale
+
+
+
+
+# Manifest of the instrument samples.
+# The audio files of instruments/<name>/ are indexed by (instrument, note) with 
+# their absolute path, duration and sample rate. The index is cached in the
+# media dir (cache/samples.json) and loaded when a sample is first looked up:
+# only the files added or changed since the last run, or that could not be
+# decoded, are read again.
+class SampleManifest():
+
+    root = "./instruments/"
+    index_file = None       # cached index, by root (None: samples.json in the media cache)
+    extensions = [".wav", ".mp3"]       # in order of preference, as manim does
+
+    entries = None      # (instrument, note) -> { path, duration, sample_rate }
+    missing = []        # (instrument, note) asked by an instrument and not found
+    invalid = []        # paths of the files that could not be decoded
+    reported = set()    # invalid files and missing notes already logged
+
+    # path of the cached index (out of the sample library, that may be read only)
+    @staticmethod
+    def index_path():
+
+        if SampleManifest.index_file is not None:
+            return SampleManifest.index_file
+
+        return os.path.join( config.media_dir, "cache", "samples.json" )
+
+    # scans the root, reading only the files not in the cached index
+    @staticmethod
+    def load( root = None ):
+
+        if root is not None:
+            SampleManifest.root = root
+        root = SampleManifest.root
+        index_path = SampleManifest.index_path()
+        root_key = os.path.abspath(root)
+
+        try:
+            with open(index_path) as f:
+                indexes = json.load(f)
+        except (OSError, ValueError):
+            indexes = {}
+        cached = indexes.get(root_key, {})
+
+        index = {}
+        changed = False
+        for name in sorted( os.listdir(root) ):
+            folder = os.path.join(root, name)
+            if not os.path.isdir(folder):
+                continue
+
+            for file_name in sorted( os.listdir(folder) ):
+                if os.path.splitext(file_name)[1] not in SampleManifest.extensions:
+                    continue
+
+                key = name + "/" + file_name
+                stat = os.stat( os.path.join(folder, file_name) )
+                # a file that could not be decoded is probed again (a decoder
+                # may have been installed since)
+                info = cached.get(key)
+                if info is None or info["duration"] is None or \
+                        info["size"] != stat.st_size or info["mtime"] != stat.st_mtime:
+                    duration, sample_rate = SampleManifest.probe( os.path.join(folder, file_name) )
+                    info = { 
+                        "size": stat.st_size, "mtime": stat.st_mtime, 
+                        "duration": duration, "sample_rate": sample_rate 
+                    }
+                    changed = changed or info != cached.get(key)
+                index[key] = info
+
+        if changed or len(index) != len(cached):
+            indexes[root_key] = index
+            try:
+                os.makedirs( os.path.dirname(index_path), exist_ok = True )
+                with open(index_path, "w") as f:
+                    json.dump(indexes, f, indent = 1, sort_keys = True)
+            except OSError:
+                pass        # no cache: the index is rebuilt at every run
+
+        entries = {}
+        invalid = []
+        for key in sorted( index, key = lambda k: SampleManifest.extensions.index(os.path.splitext(k)[1]) ):
+            if index[key]["duration"] is None:
+                invalid.append( os.path.join(root, key) )
+                continue
+
+            name, file_name = key.split("/")
+            note = os.path.splitext(file_name)[0]
+            if (name, note) not in entries:
+                entries[(name, note)] = {
+                    "path": os.path.abspath( os.path.join(root, key) ),
+                    "duration": index[key]["duration"],
+                    "sample_rate": index[key]["sample_rate"],
+                }
+
+        SampleManifest.entries = entries
+        SampleManifest.missing = []
+        SampleManifest.invalid = invalid
+        return entries
+
+    # duration (seconds) and sample rate of an audio file, (None, None) if it 
+    # cannot be decoded (truncated, corrupted, or no decoder for it)
+    @staticmethod
+    def probe( path ):
+
+        try:
+            with wave.open(path) as w:
+                return w.getnframes() / w.getframerate(), w.getframerate()
+        except (wave.Error, EOFError):
+            pass
+
+        try:
+            segment = AudioSegment.from_file(path)
+            return segment.duration_seconds, segment.frame_rate
+        except (CouldntDecodeError, OSError, IndexError, ValueError):
+            return None, None
+
+    # entry of a note of an instrument, None if there is no sample.
+    # Sharps are written "s" in the file names: "G#" is looked up as "Gs"
+    @staticmethod
+    def resolve( instrument, note ):
+
+        if SampleManifest.entries is None:
+            SampleManifest.load()
+
+        for n in [ note, note.replace("#", "s") ]:
+            if (instrument, n) in SampleManifest.entries:
+                return SampleManifest.entries[(instrument, n)]
+
+        return None
+
+    # samples of an instrument, by note
+    @staticmethod
+    def notes( instrument ):
+
+        if SampleManifest.entries is None:
+            SampleManifest.load()
+
+        return { 
+            note: entry for (name, note), entry in SampleManifest.entries.items() 
+            if name == instrument 
+        }
+
+    # logs the files that could not be decoded, and the notes with 
+    # no sample and no root to synthesize them, by instrument (once each)
+    @staticmethod
+    def report_missing():
+
+        for path in SampleManifest.invalid:
+            if path not in SampleManifest.reported:
+                SampleManifest.reported.add(path)
+                logger.warning( "invalid sample (cannot be decoded): %s", path )
+
+        by_instrument = {}
+        for instrument, note in SampleManifest.missing:
+            if (instrument, note) not in SampleManifest.reported:
+                SampleManifest.reported.add( (instrument, note) )
+                by_instrument.setdefault(instrument, []).append(note)
+
+        for instrument, notes in by_instrument.items():
+            logger.warning( 
+                "missing samples for %s: %s (in %s)", 
+                instrument, ", ".join(notes), os.path.join(SampleManifest.root, instrument)
+            )
+
+        return by_instrument
+
+
+
+# Synthesis of the notes an instrument has no sample for.
+# The nearest sample of the instrument (the root) is resampled to the pitch, 
+# as a sampler does: one semitone up plays the root 2^(1/12) times faster.
+# The synthesized notes are cached as wav files in the media dir, so any 
+# scale can be played by any instrument with a few samples per octave.
+class SampleSynth():
+
+    pitch_classes = { "C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11 }
+    max_shift = 12          # semitones, further from the root it sounds unnatural
+    recipes = {}            # path of a synthesized note -> (path of the root, semitones)
+
+    # semitones of a note: "C" is the first octave of the scales, "C2" the second, 
+    # "Gs" or "G#" a sharp; None for samples that are not notes (drums)
+    @staticmethod
+    def pitch( note ):
+
+        match = re.fullmatch( r"([A-G])(s|#)?(\d?)(s|#)?", note )       # "Gs3" or "A3s"
+        if match is None:
+            return None
+
+        letter, sharp, octave, sharp_after = match.groups()
+        octave = int(octave) if octave else 1
+        sharp = 1 if sharp or sharp_after else 0
+        return 12*octave + SampleSynth.pitch_classes[letter] + sharp
+
+    # path of a synthesized note (created when it is first played), the root itself 
+    # when it has the same pitch, None if the instrument has no root close enough
+    @staticmethod
+    def path( instrument, note ):
+
+        target = SampleSynth.pitch(note)
+        if target is None:
+            return None
+
+        roots = {}
+        for root_note, entry in SampleManifest.notes(instrument).items():
+            pitch = SampleSynth.pitch(root_note)
+            if pitch is not None:
+                roots[root_note] = (pitch, entry["path"])
+        if len(roots) == 0:
+            return None
+
+        # libraries named by absolute octave (banjo: "A3".."G5") start the scales 
+        # at their lowest octave
+        if all( re.search(r"\d", n) for n in roots ):
+            lowest = min( p for p, _ in roots.values() ) // 12
+            target += 12*(lowest - 1)
+
+        root_note = min( roots, key = lambda n: abs(roots[n][0] - target) )
+        pitch, root = roots[root_note]
+        semitones = target - pitch
+        if abs(semitones) > SampleSynth.max_shift:
+            return None
+        if semitones == 0:
+            return root
+
+        # the name keeps root and shift: the cached file is rebuilt if the roots change
+        path = os.path.join( 
+            config.media_dir, "synth", instrument, 
+            "%s_%s%+d.wav" % (note.replace("#", "s"), root_note, semitones)
+        )
+        SampleSynth.recipes[path] = (root, semitones)
+        return path
+
+    # segment resampled by some semitones (vectorized linear interpolation)
+    @staticmethod
+    def shift( segment, semitones ):
+
+        ratio = 2 ** (semitones/12)
+        samples = np.array( segment.get_array_of_samples() ).reshape(-1, segment.channels)
+        if len(samples) < 2:
+            return segment
+
+        positions = np.arange( int( (len(samples)-1)/ratio ) ) * ratio
+        left = positions.astype(int)
+        fraction = (positions - left)[:, None]
+        shifted = samples[left]*(1 - fraction) + samples[left + 1]*fraction
 
-        selected = []
+        return segment._spawn( np.round(shifted).astype(samples.dtype).tobytes() )
 
-        for i in range(len(self.instruments)):
-            if random.random()<self.probabilities[i]:
-                selected.append(i)
+    # decoded synthesized note, from the cache or resampled from its root
+    @staticmethod
+    def segment( path ):
 
-        if self.use == "nesting":         
-            note = level
-        else: 
-            note = subtowers_count
+        if os.path.exists(path):
+            return AudioSegment.from_file(path)
 
-        for i in range(len(selected)):
-            sounds = self.instruments[selected[i]].sounds(note)
-            
-            for s in sounds:
-                self.scene.add_sound( s, gain = self.gains[selected[i]] )  
+        root, semitones = SampleSynth.recipes[path]
+        segment = SampleSynth.shift( SampleCache.get(root), semitones )
 
-        return selected
+        os.makedirs( os.path.dirname(path), exist_ok = True )
+        segment.export( path, format = "wav" )
+        return segment
 
 
-# Player that plays instruments alternatively    
-class InstrumentAlternatePlayer( InstrumentPlayer ):
 
-    def __init__( 
-        self, scene, instruments, probabilities, gains, instrument_display, 
-        use = "nesting", up=True 
-    ):
+class Instrument():
 
-        self.scene = scene
-        self.instruments = instruments
-        self.probabilities = probabilities
-        self.instrument_display = instrument_display
-        self.up = up
-        self.use = use
-        self.gains = gains
+    def __init__(
+        self, name, 
+        icon_txt = None, 
+        icon_color = YELLOW,
+        icon_svg_file = None, 
+        icon_svg_color = None,
+        icon_svg_dir = "./instruments/svg/", 
+        max = 8, 
+        scale = Std_Scale
 
-    
-    # select instrument 
-    def select_instrument(self):
-        r = random.random()
-        total = 0
-        for i in range(len(self.probabilities)):
-            total += self.probabilities[i]
-            if total>r:
-                return i
+    ) -> None:
+        self.name = name
+        self.icon_txt = icon_txt
+        if icon_txt is not None:
+            self.icon_type = "txt"
         
-        return None
-    
+        self.icon_svg_file = icon_svg_file
+        if icon_svg_file is not None:
+            self.icon_type = "svg"
 
-    def play_sound( self, level, subtowers_count ):
+        self.icon_svg_dir = icon_svg_dir
+        self.icon_color = icon_color
+        self.icon_svg_color = icon_svg_color
 
-        i = self.select_instrument()
+        self.max = max
+        self.set_scale(scale)
 
-        if self.use == "nesting":
-            note = level
-        else: 
-            note = subtowers_count
+        # the icon is built when it is first needed, or in background by the AssetLoader
+        self._icon = None
+        self.icon_future = None
 
-        sounds = self.instruments[i].sounds(note)
-        
-        for s in sounds:
-            self.scene.add_sound( s, self.gains[i] )  
+    @property
+    def icon(self):
+        if self._icon is None:
+            if self.icon_future is not None:
+                self.icon_future.result()
+            else:
+                self.load_icon()
 
-        return [i]
-    
-    
-    
-# base class for displays (they implement update)
-class TowerAppDisplay():
+        return self._icon
 
-    def __init__(self) -> None:
-        pass
+    def load_icon(self):
 
-    def update(self, level = None, subtowers = None, rule = None):
-        pass
+        if self.icon_type == "txt":
+            icon = Text(self.icon_txt, color=self.icon_color)
+            if icon.width>DISPLAY_WIDTH*0.9:
+                icon.scale_to_fit_width(DISPLAY_WIDTH*0.9)
+            if icon.height>DISPLAY_HEIGHT*0.9:
+                icon.scale_to_fit_height(DISPLAY_HEIGHT*0.9)
+        else:
+            icon = SVGMobject( 
+                self.icon_svg_dir + self.icon_svg_file + ".svg", height = 0.7*DISPLAY_HEIGHT, 
+            )
+            if self.icon_svg_color is not None:
+                icon.set_color(self.icon_svg_color)
 
-# null display
-class NullDisplay():
+        self._icon = icon
+        return icon
 
-    def __init__(self, scene) -> None:
-        self.scene = scene
-        return
+    # the scale is resolved once in a table: degree -> absolute paths of the samples,
+    # when it is first played (the samples are not indexed at import)
+    def set_scale( self, scale ):
 
-    def update(self, level = None, subtowers = None, rule = None):
-        return []
+        self.scale = scale
+        self._table = None
 
-# display for level
-class LevelDisplay(TowerAppDisplay):
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = self.resolve_scale()
 
-    def __init__(self, scene) -> None:
-        
-        self.scene = scene
-        self.rect = RoundedRectangle(
-            width=DISPLAY_WIDTH, height=DISPLAY_HEIGHT, 
-            corner_radius=0.3, color=BORDER_COLOR, stroke_width=2
-        )
-        self.rect.move_to([0,TOP_MARGIN - DISPLAY_HEIGHT*2 - DISPLAY_SPACING,0])
-        self.rect.align_to([RIGHT_MARGIN,0,0], RIGHT)
-        scene.add( self.rect )
-        lvl = Text("lvl", font_size = 14, color = BLUE).move_to(self.rect)
-        lvl.align_to([0,self.rect.get_top()[1]-0.05,0], UP)
-        scene.add(lvl)
+        return self._table
 
-        self.value = "."
-        self.num = Text(self.value).move_to(self.rect)
+    def resolve_scale(self):
 
-    def update(self, level = None, subtowers = None, rule = None):            
+        table = []
+        if self.max<1:
+            return table        # no sound for this instrument
+
+        for degree in self.scale:
+            notes = degree if isinstance(degree, list) else [degree]
+            paths = []
+            for note in notes:
+                entry = SampleManifest.resolve(self.name, note)
+                if entry is not None:
+                    paths.append( entry["path"] )
+                    continue
+
+                # no sample: pitch shift the nearest one
+                path = SampleSynth.path(self.name, note)
+                if path is not None:
+                    paths.append( path )
+                elif (self.name, note) not in SampleManifest.missing:
+                    SampleManifest.missing.append( (self.name, note) )
+            table.append(paths)
+
+        return table
 
-        self.value = level
-        self.tmp = self.num
-        self.num = Text(str(level), color=Tower.select_color_by_level(level))
-        if level == -1:
-            self.num = Text(str("∞"), color=Tower.select_color_by_level(1))
-        self.num.move_to(self.rect) 
-        
-        return [ReplacementTransform(self.tmp, self.num)]
-    
-# display for number of subtowers
-class SubtowersDisplay(TowerAppDisplay):
+    def sounds(self, number):
+        if len(self.table) == 0:
+            return []        # no sound for this instrument
 
-    def __init__(self, scene) -> None:
-        
-        self.scene = scene
-        self.rect = RoundedRectangle(
-            width=DISPLAY_WIDTH, height=DISPLAY_HEIGHT, 
-            corner_radius=0.3, color=BORDER_COLOR, stroke_width=2
-        )
-        self.rect.move_to([0,TOP_MARGIN - DISPLAY_HEIGHT*3 - DISPLAY_SPACING*2,0])
-        self.rect.align_to([RIGHT_MARGIN,0,0], RIGHT)
-        scene.add( self.rect )
-        chd = Text("children", font_size = 14, color = BLUE).move_to(self.rect)
-        chd.align_to([0,self.rect.get_top()[1]-0.05,0], UP)
-        scene.add(chd)
+        # number %= self.max
+        return self.table[ number % len(self.table) ] # TODO: use max or len(scale)
 
-        self.value = "."
-        self.num = Text(self.value).move_to(self.rect)
+    # all the sounds of the scale (used for preloading)
+    def all_sounds(self):
+        if self.max<1:
+            return []
 
-    def update(self, level = None, subtowers = None, rule = None):            
+        sounds = []
+        for number in range(len(self.scale)):
+            for s in self.sounds(number):
+                if s not in sounds:
+                    sounds.append(s)
 
-        self.value = level
-        self.tmp = self.num
-        self.num = Text(str(subtowers), color=Tower.select_color_by_level(subtowers))
-        self.num.move_to(self.rect) 
-        
-        return [ReplacementTransform(self.tmp, self.num)]
+        return sounds
 
-# display for rule being used
-class RuleDisplay(TowerAppDisplay):
 
-    def __init__(self, scene, title = None, subtitle = None, blocks = 5) -> None:
 
-        if title is None and subtitle is None:
+# Cache of decoded samples.
+# The file writer of manim decodes the file at every add_sound,
+# here every file is decoded only once per process. Gains are not cached
+# (they are amplitudes in the mix, see SoundMixer.mix): the cache grows 
+# with the files, not with the gains.
+class SampleCache():
+
+    segments = {}
+    pending = {}        # sound file -> future of the decoded segment
+    arrays = {}         # (sound file, frame rate, channels) -> samples (frames x channels)
+
+    # decoded segment for a sound file (the path is resolved as manim does)
+    @staticmethod
+    def get( sound_file, gain = None ):
+
+        if gain:
+            return SampleCache.get(sound_file).apply_gain(gain)
+
+        key = (sound_file, None)
+        if key in SampleCache.segments:
+            return SampleCache.segments[key]
+
+        # decoding in background: the main thread waits for it, the workers
+        # decode by themselves (waiting in a worker could block the pool)
+        future = SampleCache.pending.get(sound_file)
+        if future is not None and (
+            future.done() or threading.current_thread() is threading.main_thread()
+        ):
+            segment = future.result()
+        else:
+            segment = SampleCache.decode(sound_file)
+
+        SampleCache.segments[key] = segment
+        return segment
+
+    # samples of a sound file at a rate and channels, as float32 frames x channels
+    # in the range of sample_width bytes integers
+    @staticmethod
+    def array( sound_file, frame_rate, channels, sample_width = 2 ):
+
+        key = (sound_file, frame_rate, channels)
+        if key not in SampleCache.arrays:
+            segment = SampleCache.get(sound_file).set_frame_rate(frame_rate).set_channels(channels)
+            segment = segment.set_sample_width(sample_width)
+            SampleCache.arrays[key] = np.array( 
+                segment.get_array_of_samples(), dtype = np.float32 
+            ).reshape(-1, channels)
+
+        return SampleCache.arrays[key]
+
+    @staticmethod
+    def decode( sound_file ):
+
+        if sound_file in SampleSynth.recipes:
+            return SampleSynth.segment(sound_file)
+
+        return AudioSegment.from_file( get_full_sound_file_path(sound_file) )
+
+    # starts decoding a sound file in a thread pool (see AssetLoader)
+    @staticmethod
+    def get_async( sound_file, executor ):
+
+        if (sound_file, None) in SampleCache.segments or sound_file in SampleCache.pending:
             return
-        
-        self.scene = scene
-        self.rect = RoundedRectangle(
-            width=DISPLAY_WIDTH*blocks, height=DISPLAY_HEIGHT, 
-            corner_radius=0.3, color=BORDER_COLOR, stroke_width=2
-        )
-        self.rect.move_to([0,TOP_MARGIN - DISPLAY_HEIGHT,0])
-        self.rect.align_to([LEFT_MARGIN,0,0], LEFT)
-        scene.add( self.rect )
 
-        if title is not None:
-            txt = Text(title, color = YELLOW, font_size = 18).move_to(self.rect)
-            # txt.stretch_to_fit_width(DISPLAY_WIDTH*3)
-            txt.align_to([self.rect.get_left()[0]+0.3,0], LEFT)
-            txt.align_to([0,self.rect.get_top()[1]-0.05,0], UP)
-            scene.add(txt)
+        SampleCache.pending[sound_file] = executor.submit( SampleCache.decode, sound_file )
 
-        self.rule = subtitle
-        txt2 = Text(subtitle, color = YELLOW)
-        # txt2.stretch_to_fit_width(DISPLAY_WIDTH*2)
-        txt2.align_to([self.rect.get_left()[0]+0.4,0], LEFT)
-        txt2.align_to([0,self.rect.get_bottom()[1]+0.1,0], DOWN)
-        self.txt2 = txt2
-        scene.add(txt2)
+    # decode all the sounds of the instruments
+    @staticmethod
+    def preload( instruments ):
 
-    def update(self, level = None, subtowers = None, rule = None):            
-        return []
+        for instrument in instruments:
+            for s in instrument.all_sounds():
+                SampleCache.get(s)
 
+    @staticmethod
+    def clear():
+        SampleCache.segments = {}
+        SampleCache.pending = {}
+        SampleCache.arrays = {}
 
-# display for the expression of the set (or tower)
-class ExpressionDisplay():
 
-    def __init__(self, scene, blocks = 10) -> None:
 
-        self.scene = scene
-        self.rect = RoundedRectangle(
-            width=DISPLAY_WIDTH*blocks, height=DISPLAY_HEIGHT, 
-            corner_radius=0.3, color=BORDER_COLOR, stroke_width=2
-        )
-        self.rect.move_to([0, BOTTOM_MARGIN + DISPLAY_HEIGHT,0])
-        self.expr_mobj = VGroup().move_to(self.rect)
-        self.saved_expr_mobj = None
-        self.new_expr_mobj = VGroup().move_to(self.rect)
-        scene.add( self.rect )
+# Background loading of the assets of the instruments of a scene.
+# A thread pool decodes the samples and parses the svg icons while the scene
+# is set up and the towers are built: SampleCache.get and Instrument.icon wait 
+# only for an asset still loading when it is first needed.
+# Text icons are built on the main thread (pango is not thread safe).
+class AssetLoader():
 
-    def update(self, token = None, dir = RIGHT, color = BLUE):            
-        if token is not None:
-            self.scene.remove(self.expr_mobj)
+    workers = 4
+    executor = None
 
-            expr = Text(token, color = color).next_to(self.expr_mobj, dir)        
-            self.expr_mobj.add( expr ).move_to(self.rect)
-    
-            self.display_expression()
+    @staticmethod
+    def start( instruments ):
 
-            return expr
-    
-    def display_expression(self):
+        if AssetLoader.executor is None:
+            AssetLoader.executor = concurrent.futures.ThreadPoolExecutor( 
+                AssetLoader.workers, thread_name_prefix = "assets" 
+            )
 
-        if self.expr_mobj.width>self.rect.width:
-            self.expr_mobj.stretch_to_fit_width(self.rect.width)
+        for instrument in instruments:
+            if instrument.icon_type == "svg" and instrument._icon is None and instrument.icon_future is None:
+                instrument.icon_future = AssetLoader.executor.submit( instrument.load_icon )
 
-        self.scene.add( self.expr_mobj )
+        for instrument in instruments:
+            for s in instrument.all_sounds():
+                SampleCache.get_async( s, AssetLoader.executor )
 
 
 
-    def copy_state(self):
-        return self.expr_mobj.copy()
+# Loudness of the samples, to play every instrument at the same level.
+# The loudness is the gated mean power of 400 ms blocks, as in EBU R128 but 
+# without the K-weighting filter; peak and rms are in dBFS too. The analysis is 
+# done once and cached in the media dir (cache/loudness.json), by file size and time.
+class SampleLoudness():
 
-    def reset_state( self, old_state, token1, new_expressions, token2, color ):
+    folders = ["./instruments/", "./sounds/"]
+    cache_file = None       # None: loudness.json in the cache of the media dir
+    headroom = -1.0         # dBFS, max peak of a normalized sample
 
-        self.scene.remove( self.expr_mobj )
-        self.expr_mobj = old_state
+    levels = None           # path -> { size, mtime, loudness, rms, peak }
+
+    @staticmethod
+    def cache_path():
 
-        open = Text(token1, color = color).next_to(self.expr_mobj, RIGHT) 
+        if SampleLoudness.cache_file is not None:
+            return SampleLoudness.cache_file
 
-        current = open
-        for n in new_expressions:
-            n.next_to(current, RIGHT)
-            current = n
+        return os.path.join( config.media_dir, "cache", "loudness.json" )
 
-        close = Text(token2, color = color).next_to(current, RIGHT) 
+    # analyzes the samples of the folders, only the ones changed since the last time
+    # (the files the manifest could not decode, or that fail now, are left out)
+    @staticmethod
+    def load():
+
+        if SampleManifest.entries is None:
+            SampleManifest.load()
+        invalid = { os.path.relpath(path) for path in SampleManifest.invalid }
+
+        try:
+            with open(SampleLoudness.cache_path()) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+
+        levels = {}
+        for folder in SampleLoudness.folders:
+            for directory, _, files in os.walk(folder):
+                for file_name in sorted(files):
+                    if os.path.splitext(file_name)[1] not in SampleManifest.extensions:
+                        continue
+
+                    path = os.path.relpath( os.path.join(directory, file_name) )
+                    if path in invalid:
+                        continue
+
+                    stat = os.stat(path)
+                    level = cached.get(path)
+                    if level is None or level["size"] != stat.st_size or level["mtime"] != stat.st_mtime:
+                        try:
+                            segment = AudioSegment.from_file(path)
+                        except (CouldntDecodeError, OSError, IndexError, ValueError):
+                            continue
+                        loudness, rms, peak = SampleLoudness.analyze(segment)
+                        level = { 
+                            "size": stat.st_size, "mtime": stat.st_mtime, 
+                            "loudness": loudness, "rms": rms, "peak": peak 
+                        }
+                    levels[path] = level
+
+        if levels != cached:
+            try:
+                path = SampleLoudness.cache_path()
+                os.makedirs( os.path.dirname(path) or ".", exist_ok = True )
+                with open(path, "w") as f:
+                    json.dump(levels, f, indent = 1, sort_keys = True)
+            except OSError:
+                pass
+
+        SampleLoudness.levels = levels
+        return levels
+
+    # (loudness, rms, peak) of a segment, in dBFS
+    @staticmethod
+    def analyze( segment ):
 
-        updated_new_expr_mobj = VGroup()
-        updated_new_expr_mobj.add( open )
-        updated_new_expr_mobj.add( *new_expressions )
-        updated_new_expr_mobj.add( close )
+        full_scale = float( 1 << (8*segment.sample_width - 1) )
+        samples = np.array( segment.get_array_of_samples(), dtype = float ) / full_scale
+        samples = samples.reshape(-1, segment.channels)
+        if len(samples) == 0:
+            return -120.0, -120.0, -120.0
 
-        self.expr_mobj.add(updated_new_expr_mobj)
+        def db(power):
+            return 10*np.log10( np.maximum(power, 1e-12) )
 
-        self.expr_mobj.move_to( self.rect )
+        power = np.mean( samples*samples, axis = 1 )
+        block = int( 0.4*segment.frame_rate )
+        if len(power) <= block:
+            blocks = np.array( [power.mean()] )
+        else:
+            # 400 ms blocks overlapping by 75%
+            cumulative = np.concatenate( [[0], np.cumsum(power)] )
+            starts = np.arange( 0, len(power) - block + 1, block // 4 )
+            blocks = (cumulative[starts + block] - cumulative[starts]) / block
 
-        self.display_expression()
+        # absolute gate at -70, relative gate 10 dB below the mean of the rest
+        gated = blocks[ db(blocks) > -70 ]
+        if len(gated) > 0:
+            gated = gated[ db(gated) > db(gated.mean()) - 10 ]
+        loudness = db( gated.mean() ) if len(gated) > 0 else -120.0
 
-        return updated_new_expr_mobj
-        
+        peak = 20*np.log10( max( np.max(np.abs(samples)), 1e-6 ) )
+        return float(loudness), float( db(power.mean()) ), float(peak)
 
+    # level of a sample (a synthesized note has the level of its root)
+    @staticmethod
+    def level( sound_file ):
 
+        if SampleLoudness.levels is None:
+            SampleLoudness.load()
 
+        if sound_file in SampleSynth.recipes:
+            sound_file = SampleSynth.recipes[sound_file][0]
+        path = os.path.relpath(sound_file)
 
-        
-        
+        if path not in SampleLoudness.levels:
+            loudness, rms, peak = SampleLoudness.analyze( SampleCache.get(sound_file) )
+            SampleLoudness.levels[path] = { "loudness": loudness, "rms": rms, "peak": peak }
 
+        return SampleLoudness.levels[path]
 
+    # gain (dB) that brings a sample to the target loudness, 
+    # limited so that the peak stays below the headroom
+    @staticmethod
+    def gain( sound_file, target ):
 
-# Earth object where towers lie
-class Earth(VGroup):
+        level = SampleLoudness.level(sound_file)
+        return min( target - level["loudness"], SampleLoudness.headroom - level["peak"] )
 
-    def __init__(self, level, minx, maxx) -> None:
-        super().__init__()
-        self.level = level
-        self.minx = minx
-        self.maxx = maxx
-        self.line = Line([minx, level, 0], [maxx, level, 0])        
-        self.add(self.line)
+    # Estimated peak (dBFS) of the loudest event of a scene, before it is rendered:
+    # the peaks of the samples of a note (with their gains) summed, for the 
+    # loudest note of every instrument that can play in the same event.
+    # An upper bound of one event: the mix of the scene is checked when it ends 
+    # (see SoundMixer.check_clipping).
+    @staticmethod
+    def estimate_peak( instruments, gains, target = None, together = True ):
 
-    def get_level(self):
-        return self.level
+        peaks = []
+        for instrument, gain in zip(instruments, gains):
+            loudest = 0
+            for number in range(len(instrument.table)):
+                amplitude = 0
+                for s in instrument.sounds(number):
+                    total = (gain or 0) + ( SampleLoudness.gain(s, target) if target is not None else 0 )
+                    amplitude += 10 ** ( (SampleLoudness.level(s)["peak"] + total) / 20 )
+                loudest = max(loudest, amplitude)
+            peaks.append(loudest)
 
-    def get_minx(self):
-        return self.minx
+        amplitude = sum(peaks) if together else max(peaks, default = 0)
+        return 20*log10(amplitude) if amplitude > 0 else float("-inf")
 
-    def get_maxx(self):
-        return self.maxx
 
-    def vibrate(self, scale = 1.15, angle = 0.02, level = None, subtowers = None, rule = None):
-        return [Wiggle(self.line, scale_value=scale ,rotation_angle=angle)]
 
-# Scales and Progressions
-C_Major_Scale = ["C", "D", "E", "F", "G", "A", "B", "C2"]
-E_Major_Scale = ["E", "Fs", "G#", "A", "B", "C2s", "D2s", "E2"]
-Pentatonic_Scale = ["Cs", "Ds", "Fs", "Gs", "As" ]
-Choords_1451 = [ ["C", "E", "G"], ["F", "A", "C"], ["G", "B", "D"], ["C", "E", "G"] ]
-Diatonic_Scale = [ "F", "C", "G", "D", "F", "A", "E", "B"]
 
-# Std scale used as default
-Std_Scale = C_Major_Scale
+# Mixer of the sounds of a scene.
+# The sounds are collected and mixed when the scene ends: identical samples 
+# triggered at the same time become one voice with the gains summed, and at most
+# max_voices sound together (a new voice cuts the oldest one), so the cost of the 
+# mix stays bounded also with very fast transitions.
+# The voices are summed in one numpy buffer (see mix), the soundtrack is written once.
+class SoundMixer():
+
+    resolution = 0.01       # seconds, triggers closer than this are simultaneous
+    fade_out = 20           # ms, fade of a cut voice (no click)
+    sample_width = 2        # bytes of the samples of the mix
+
+    def __init__(self, max_voices = 16):
+        self.max_voices = max_voices
+        self.events = {}        # (time step, sound file) -> [time, amplitude, kwargs]
+        self.peak = None        # dBFS of the last mix before clipping (above 0 it clips)
+        self.peak_time = None   # seconds, where the peak is
+
+    def add(self, sound_file, time, gain = None, **kwargs):
+
+        key = ( round(time / SoundMixer.resolution), sound_file )
+        amplitude = 10 ** ( (gain or 0) / 20 )
+
+        if key in self.events:
+            self.events[key][1] += amplitude
+        else:
+            self.events[key] = [time, amplitude, kwargs]
+
+    # [(time, sound file, amplitude, kept ms or None, kwargs)] of the voices to mix:
+    # a voice cut by a newer one keeps only its first ms (and fades out)
+    def voices(self):
+
+        voices = []         # [time, sound file, amplitude, kept ms, kwargs, end]
+        playing = []        # indexes of the voices still sounding, oldest first
+
+        for (_, sound_file), (time, amplitude, kwargs) in sorted( 
+            self.events.items(), key = lambda e: e[1][0] 
+        ):
+            duration = SampleCache.get(sound_file).duration_seconds
+
+            playing = [ i for i in playing if voices[i][5] > time ]
+            while self.max_voices and len(playing) >= self.max_voices:
+                oldest = voices[ playing.pop(0) ]
+                oldest[3] = int( (time - oldest[0]) * 1000 )
+                oldest[5] = time
+
+            playing.append( len(voices) )
+            voices.append( [time, sound_file, amplitude, None, kwargs, time + duration] )
+
+        return [ tuple(v[:5]) for v in voices ]
+
+    # segment of a voice, with its gain and its cut (for the file writer)
+    @staticmethod
+    def segment( sound_file, amplitude, keep = None ):
+
+        segment = SampleCache.get( sound_file, 20*log10(amplitude) )
+        if keep is not None:
+            segment = segment[:keep]
+            if keep > 0:
+                segment = segment.fade_out( min(SoundMixer.fade_out, keep) )
+
+        return segment
+
+    # Segment of the voices [(time, sound file, amplitude, kept ms or None)] summed, 
+    # None without voices. Every sample is converted once to the rate and channels 
+    # of the mix (see SampleCache.array), then added to the buffer at its time 
+    # times its amplitude: the cost grows with the length of the voices, not with 
+    # the length of the soundtrack times the voices.
+    def mix(self, voices):
+
+        if len(voices) == 0:
+            return None
+
+        segments = [ SampleCache.get(sound_file) for _, sound_file, _, _ in voices ]
+        rate = max( segment.frame_rate for segment in segments )
+        channels = max( segment.channels for segment in segments )
+
+        placed = []
+        length = 0
+        for time, sound_file, amplitude, keep in voices:
+            data = SampleCache.array( sound_file, rate, channels, SoundMixer.sample_width )
+            fade = 0
+            if keep is not None:
+                data = data[ : keep * rate // 1000 ]
+                fade = min( SoundMixer.fade_out, keep ) * rate // 1000
+
+            start = int( round(time * rate) )
+            placed.append( (start, data, amplitude, fade) )
+            length = max( length, start + len(data) )
+
+        buffer = np.zeros( (length, channels), dtype = np.float32 )
+        for start, data, amplitude, fade in placed:
+            data = amplitude * data
+            if fade > 0:
+                # a cut voice fades out linearly in its last ms (no click)
+                data[-fade:] *= np.linspace(1, 0, fade, dtype = np.float32)[:, None]
+            buffer[start:start+len(data)] += data
+
+        limit = 2 ** (8*SoundMixer.sample_width - 1)
+        loudest = int( np.abs(buffer).max(axis = 1).argmax() )
+        peak = float( np.abs(buffer[loudest]).max() ) / limit
+        self.peak = 20*log10(peak) if peak > 0 else float("-inf")
+        self.peak_time = loudest / rate
+
+        data = np.clip( buffer, -limit, limit-1 ).astype(np.int16)
+        return AudioSegment( 
+            data.tobytes(), sample_width = SoundMixer.sample_width, 
+            frame_rate = rate, channels = channels 
+        )
+
+    # warns if the last mix clips (the voices summed go over full scale), returns the peak
+    def check_clipping(self):
+
+        if self.peak is None or self.peak <= 0:
+            return None
+
+        logger.warning( 
+            "the soundtrack clips: peak %+.1f dBFS at %.2f s", self.peak, self.peak_time 
+        )
+        return self.peak
+
+    def clear(self):
+        self.events = {}
+
+
+
+# Export of the notes played in a scene (TowerApp.note_log) as a standard midi file.
+# Every instrument gets a channel and a General MIDI program, the percussions go 
+# to the drum channel (10, 9 counting from 0). A tick is a millisecond of scene time.
+# scene time without a scene: plays and waits advance it by whole frames like the
+# renderer does, and the notes are logged like TowerApp.add_note
+class NoteClock():
+
+    def __init__(self, max_notes_per_second = 10, frame_rate = None):
+        self.time = 0
+        self.frame = 1 / (frame_rate or config.frame_rate)
+        self.max_notes_per_second = max_notes_per_second
+        self.last_note_time = None
+        self.note_log = []
+
+    def play(self, run_time):
+        self.time += len( np.arange(0, run_time, self.frame) ) * self.frame
+
+    # a static wait: int(duration/frame) frozen frames
+    def wait(self, duration):
+        self.time += int( duration / self.frame ) * self.frame
+
+    def add_note(self, instrument, number, gain = None):
+
+        time = self.time
+        if self.max_notes_per_second > 0 and self.last_note_time is not None:
+            if time != self.last_note_time and time - self.last_note_time < 1 / self.max_notes_per_second:
+                return
+        self.last_note_time = time
+
+        self.note_log.append( (time, instrument, number, gain) )
+
+
+class MidiExport():
+
+    # instrument -> (program, transpose in semitones), None for percussions
+    programs = {
+        "guitar": (25, 0), "classicguitar": (24, 0), "banjo": (105, 0), "banjo2": (105, 0),
+        "elecbass": (33, -24), "bass": (32, -24), "doublebass": (43, -24), "doublebass2": (43, -24),
+        "trombone": (57, -12), "trumpet": (56, 0), "sax": (65, 0), "sax_s": (64, 12),
+        "voice": (52, 0), "squeak": (121, 12), "pianochoords": (0, 0),
+        "drums": None, "cymbals": None, "tom": None,
+    }
+
+    # percussion keys, by sample number (or scale degree)
+    drum_keys = {
+        "drums": [35, 36, 38, 40, 41, 42, 43, 45, 46, 47, 48, 49],
+        "cymbals": [49, 51, 57],
+        "tom": [41, 43, 45, 47, 48, 50],
+    }
+
+    drum_channel = 9
+    ticks_per_quarter = 500     # at the default tempo (120 bpm) a tick is 1 ms
+    note_length = 0.5           # seconds, when the duration of the sample is unknown
+
+    # the note log of TowerApp.play_set, timed on a NoteClock: nothing is rendered
+    @staticmethod
+    def play_set_notes(
+        instruments, probabilities, sequence, lod_pixels = 0, duration = None,
+        max_notes_per_second = 10, **options
+    ):
+        clock = NoteClock(max_notes_per_second)
+        player = InstrumentSeparatePlayer(
+            clock, instruments, probabilities, [0]*len(instruments), None, use = "nesting"
+        )
+
+        # create_displays: Create(earth)
+        clock.play(1)
+
+        if lod_pixels>0:
+            s = Tower.from_string_lod( sequence, lod_pixels, 1, 7, 0.6, 0.2 )
+        else:
+            s , _ = Tower.from_string_bottom_up( sequence, 0,  7, 0.6, 0.2 )
 
+        if duration is None:
+            player.plan( s.raise_events() )
+            s.raise_tower_clock(clock, player, transitions_run_time = 0.04)
+            return clock.note_log
 
+        plan, measures = s.plan_raise_in(duration)
+        if plan[0] == "scaled":
+            player.plan( s.raise_events() )
+            s.raise_tower_clock(clock, player, transitions_run_time = plan[1])
+        else:
+            _, run_time, min_size = plan
+            events = []
+            s.collect_batched_events(measures, min_size, events)
+            player.plan( events )
+            s.raise_tower_batched_clock(clock, player, run_time, measures, min_size)
 
+        return clock.note_log
 
-class Instrument():
+    # notes of a log [[tick, channel, key, velocity, end tick]], and channels by instrument
+    @staticmethod
+    def notes( note_log ):
 
-    def __init__(
-        self, name, 
-        icon_txt = None, 
-        icon_color = YELLOW,
-        icon_svg_file = None, 
-        icon_svg_color = None,
-        icon_svg_dir = "./instruments/svg/", 
-        max = 8, 
-        scale = Std_Scale
+        channels = {}
+        melodic = [ c for c in range(16) if c != MidiExport.drum_channel ]
+        notes = []
 
-    ) -> None:
-        self.name = name
-        self.icon_txt = icon_txt
-        if icon_txt is not None:
-            self.icon_type = "txt"
-        
-        self.icon_svg_file = icon_svg_file
-        if icon_svg_file is not None:
-            self.icon_type = "svg"
+        for time, instrument, number, gain in note_log:
+            if len(instrument.table) == 0:
+                continue
 
-        self.icon_svg_dir = icon_svg_dir
+            degree = number % len(instrument.scale)
+            names = instrument.scale[degree]
+            names = names if isinstance(names, list) else [names]
+            program = MidiExport.programs.get( instrument.name, (0, 0) )
 
-        self.max = max
-        self.scale = scale
+            if program is None:
+                channel = MidiExport.drum_channel
+            else:
+                if instrument.name not in channels:
+                    channels[instrument.name] = melodic[ len(channels) % len(melodic) ]
+                channel = channels[instrument.name]
+
+            velocity = round( 100 * 10 ** ( (gain or 0) / 20 ) )
+            velocity = min( max(velocity, 1), 127 )
+            tick = round(time*1000)
+
+            for name in names:
+                if program is None:
+                    keys = MidiExport.drum_keys.get( instrument.name, [38] )
+                    key = keys[ (int(name) if name.isdigit() else degree) % len(keys) ]
+                else:
+                    pitch = SampleSynth.pitch(name)
+                    key = pitch + 48 + program[1] if pitch is not None else 60 + degree
+
+                entry = SampleManifest.resolve(instrument.name, name)
+                length = entry["duration"] if entry is not None else MidiExport.note_length
+                notes.append( [tick, channel, key, velocity, tick + max( round(length*1000), 1 )] )
+
+        # a note played again cuts the previous one (a channel has one voice per key)
+        notes.sort( key = lambda n: n[0] )
+        playing = {}
+        for n in notes:
+            previous = playing.get( (n[1], n[2]) )
+            if previous is not None and previous[4] > n[0]:
+                previous[4] = n[0]
+            playing[(n[1], n[2])] = n
+
+        return [ n for n in notes if n[4] > n[0] ], channels
+
+    # variable length quantity
+    @staticmethod
+    def varlen( value ):
 
-        if self.icon_type == "txt":
-            self.icon = Text(self.icon_txt, color=icon_color)
-            if self.icon.width>DISPLAY_WIDTH*0.9:
-                self.icon.scale_to_fit_width(DISPLAY_WIDTH*0.9)
-            if self.icon.height>DISPLAY_HEIGHT*0.9:
-                self.icon.scale_to_fit_height(DISPLAY_HEIGHT*0.9)
-        else:
-            self.icon = SVGMobject( 
-                icon_svg_dir + self.icon_svg_file + ".svg", height = 0.7*DISPLAY_HEIGHT, 
-            )
-            if icon_svg_color is not None:
-                self.icon.set_color(icon_svg_color)
+        data = [ value & 0x7f ]
+        value >>= 7
+        while value > 0:
+            data.insert( 0, (value & 0x7f) | 0x80 )
+            value >>= 7
 
-    def set_scale( self, scale ):
+        return bytes(data)
 
-        self.scale = scale
+    # writes a midi file (format 0) with the notes of a log, returns the path
+    @staticmethod
+    def save( note_log, path ):
 
-    def sounds(self, number):
-        if self.max<1:
-            return []        # no sound for this instrument
+        notes, channels = MidiExport.notes(note_log)
 
-        # number %= self.max
-        number %= len(self.scale) # TODO: use max or len(scale)
+        # (tick, order, data): at the same tick note offs go before note ons
+        events = [ (0, 0, b"\xff\x51\x03\x07\xa1\x20") ]          # tempo: 500000 us per quarter
+        for name, channel in channels.items():
+            program = MidiExport.programs.get( name, (0, 0) )[0]
+            events.append( (0, 0, bytes( [0xc0 | channel, program] )) )
+        for tick, channel, key, velocity, end in notes:
+            events.append( (tick, 2, bytes( [0x90 | channel, key, velocity] )) )
+            events.append( (end, 1, bytes( [0x80 | channel, key, 0] )) )
+        events.sort( key = lambda e: (e[0], e[1]) )
 
-        if isinstance(self.scale[number],list):
-            return [
-                "./instruments/" + self.name + "/" + sound  for sound in self.scale[number]
-            ]
-        
-        return [
-            "./instruments/" + self.name + "/" + self.scale[number]
-        ]
+        track = bytearray()
+        previous = 0
+        for tick, _, data in events:
+            track += MidiExport.varlen(tick - previous) + data
+            previous = tick
+        track += b"\x00\xff\x2f\x00"     # end of track
 
+        with open(path, "wb") as f:
+            f.write( b"MThd" + (6).to_bytes(4, "big") + (0).to_bytes(2, "big") + (1).to_bytes(2, "big") )
+            f.write( MidiExport.ticks_per_quarter.to_bytes(2, "big") )
+            f.write( b"MTrk" + len(track).to_bytes(4, "big") + track )
 
+        return path
 
 
 
@@ -1488,11 +4326,19 @@ class StringPlayer():
         return c==")" or c=="]" or c=="}" or c==">"
 
 
+    # with a duration the sound time is scaled to it; when a character would last 
+    # less than a frame, the characters of a frame play one note together
     @staticmethod
-    def play_string( string, scene, instrument, sound_time=0.2 ):
+    def play_string( string, scene, instrument, sound_time=0.2, duration=None ):
+
+        group = 1
+        if duration is not None and len(string) > 0:
+            frame = 1 / config.frame_rate
+            group = max( 1, ceil( len(string) * frame / duration ) )
+            sound_time = max( duration * group / len(string), frame )
 
         level = 0
-        for c in string:
+        for i, c in enumerate(string):
             if StringPlayer.is_open_parenthesis(c):
                 level += 1
             elif StringPlayer.is_closed_parenthesis(c):
@@ -1500,8 +4346,9 @@ class StringPlayer():
 
             level %= len(instrument.scale)
 
-            [ scene.add_sound( s )  for s in instrument.sounds(level) ]
-            scene.wait( sound_time )
+            if i % group == 0:
+                scene.add_note( instrument, level )
+                scene.wait( sound_time )
 
 
 
@@ -1552,9 +4399,214 @@ PianoChoords = Instrument("pianochoords", icon_svg_file = "piano", max = 5, scal
 
 
 
+# Camera that renders only one layer of a TowerApp:
+# "base" (everything but the locale overlays) or "overlay" (only the overlays).
+# With layer None everything is rendered.
+# It also keeps the static HUD rasterized in the background (see rasterize_static).
+class LayerCamera(Camera):
+
+    layer = None
+    overlays = []
+
+    # ids of the families of the static mobjects drawn in the background
+    static_ids = set()
+    plain_background = None
+
+    def get_mobjects_to_display(self, *args, **kwargs):
+        mobjects = super().get_mobjects_to_display(*args, **kwargs)
+
+        if len(self.static_ids)>0:
+            mobjects = [ m for m in mobjects if id(m) not in self.static_ids ]
+
+        return self.in_layer(mobjects)
+
+    # the mobjects drawn in the layer of the camera
+    def in_layer(self, mobjects):
+
+        if self.layer is None:
+            return mobjects
+
+        overlay_ids = set()
+        for o in self.overlays:
+            for m in o.get_family():
+                overlay_ids.add( id(m) )
+
+        if self.layer == "overlay":
+            return [ m for m in mobjects if id(m) in overlay_ids ]
+
+        return [ m for m in mobjects if id(m) not in overlay_ids ]
+
+    # draws the static mobjects once in the background image (used by reset), 
+    # then they are skipped when the frames are drawn
+    def rasterize_static(self, mobjects):
+
+        if self.plain_background is None:
+            self.plain_background = self.background
+
+        self.static_ids = set()
+        self.set_pixel_array(self.plain_background)
+        self.capture_mobjects(mobjects)
+        self.background = np.array(self.pixel_array)
+
+        for m in mobjects:
+            for f in m.get_family():
+                self.static_ids.add( id(f) )
+
+
+
 # the app 
 class TowerApp(Scene):
 
+    # locales of the texts, the first one is used when no locale is set
+    locales = ["es", "it", "en"]
+
+    # voices that can sound at the same time (0: no limit)
+    max_voices = 16
+
+    # with sounds_on False the notes are only logged
+    sounds_on = True
+
+    # max rate of the notes (0: no limit), see add_note
+    max_notes_per_second = 0
+    last_note_time = None
+
+    # notes are normalized to the target loudness (dBFS), the gains of the
+    # players are added to it
+    normalize = True
+    target_loudness = -20.0
+
+    def __init__(self, layer = None, locale = None, **kwargs):
+
+        kwargs.setdefault("camera_class", LayerCamera)
+
+        self.layer = layer
+        self.locale = locale
+        self.overlays = []
+        self.hud_queue = []
+        self.static_mobjects = []
+        self.static_key = []
+        self.mixer = SoundMixer(self.max_voices)
+        self.note_log = []
+
+        super().__init__(**kwargs)
+
+        if isinstance(self.renderer.camera, LayerCamera):
+            self.renderer.camera.layer = layer
+            self.renderer.camera.overlays = self.overlays
+
+    # text for the current locale
+    # texts is a string or a dict locale -> string (the first entry is the default)
+    def tr(self, texts):
+
+        if not isinstance(texts, dict):
+            return texts
+
+        if self.locale in texts:
+            return texts[self.locale]
+
+        return next(iter(texts.values()))
+
+    # marks a locale dependent mobject (rendered in the overlay layer)
+    def overlay(self, mobject):
+
+        self.overlays.append(mobject)
+        return mobject
+
+    # marks a static HUD mobject (frames, labels, earth): while it is not animated
+    # it is drawn once in the background of the camera, and not at every frame
+    def static(self, mobject):
+
+        self.static_mobjects.append(mobject)
+        return mobject
+
+    # re-rasterizes the background when the static mobjects to draw change:
+    # added to the scene, animated by the play about to start (they, a part or 
+    # a group containing them), with updaters, or changed since the last play
+    def update_static_layer(self, animations):
+
+        camera = self.renderer.camera
+        if not isinstance(camera, LayerCamera) or len(self.static_mobjects) == 0:
+            return
+
+        animated = { 
+            id(f) for a in animations if a.mobject is not None for f in a.mobject.get_family() 
+        }
+        in_scene = { id(f) for m in self.mobjects for f in m.get_family() }
+        visible = [ 
+            m for m in camera.in_layer(self.static_mobjects) 
+            if id(m) in in_scene and not any( 
+                id(f) in animated or len(f.updaters)>0 for f in m.get_family() 
+            )
+        ]
+
+        key = [ (id(m), TowerApp.static_state(m)) for m in visible ]
+        if key != self.static_key:
+            camera.rasterize_static(visible)
+            self.static_key = key
+
+    # fingerprint of the points and colours of a static mobject and its parts
+    @staticmethod
+    def static_state(mobject):
+
+        return hash( tuple( 
+            ( 
+                f.points.tobytes(), 
+                getattr(f, "fill_rgbas", f.points).tobytes(), 
+                getattr(f, "stroke_rgbas", f.points).tobytes() 
+            ) 
+            for f in mobject.get_family() 
+        ) )
+
+    # localized text overlay
+    def localized_text(self, texts, **kwargs):
+
+        return self.overlay( Text(self.tr(texts), **kwargs) )
+
+    # Renders the scene in more languages.
+    # The towers, the sounds and the displays are rendered once (base layer),
+    # then only the locale overlays are rendered for each locale (transparent)
+    # and composited on the base: in the overlay passes the plays that do not 
+    # animate an overlay are not interpolated (see play_frozen).
+    # Returns the paths of the videos, by locale.
+    @classmethod
+    def render_locales(cls, locales = None, name = None, random_seed = 0):
+
+        if locales is None:
+            locales = cls.locales
+        if name is None:
+            name = cls.__name__
+
+        # same seed: every layer must follow the same timeline
+        with tempconfig( { "output_file": name + "_base" } ):
+            scene = cls(layer = "base", random_seed = random_seed)
+            scene.render()
+            base = str(scene.renderer.file_writer.movie_file_path)
+            base_frames = round( scene.renderer.time * config.frame_rate )
+
+        videos = {}
+        for locale in locales:
+            with tempconfig( { "output_file": name + "_" + locale + "_overlay", "transparent": True } ):
+                scene = cls(layer = "overlay", locale = locale, random_seed = random_seed)
+                scene.render()
+                overlay = str(scene.renderer.file_writer.movie_file_path)
+                frames = round( scene.renderer.time * config.frame_rate )
+
+            # a layer out of step would slide the texts off their animations
+            if frames != base_frames:
+                raise RuntimeError( 
+                    "overlay %s has %d frames, the base %d" % (locale, frames, base_frames) 
+                )
+
+            video = os.path.join( os.path.dirname(base), name + "_" + locale + ".mp4" )
+            subprocess.run( [
+                "ffmpeg", "-y", "-loglevel", "error", "-i", base, "-i", overlay,
+                "-filter_complex", "[0:v][1:v]overlay[v]",
+                "-map", "[v]", "-map", "0:a?", "-c:a", "copy", video
+            ], check = True )
+            videos[locale] = video
+
+        return videos
+
     def create_displays(
         self, instruments, colors, probabilities, gains = None,
         on_opacities = None, off_opacities = None, 
@@ -1571,23 +4623,24 @@ class TowerApp(Scene):
         if gains == None:
             gains = [0 for i in range(len(instruments))]
 
+        # icons and samples are loaded in background while the scene is set up:
+        # the displays that don't need them are built first
+        AssetLoader.start(instruments)
+        SampleManifest.report_missing()
+
+        # before anything is rendered: the levels of the samples, and the warning
+        # if the instruments of an event can clip together
+        if self.sounds_on:
+            if SampleLoudness.levels is None:
+                SampleLoudness.load()
+            peak = SampleLoudness.estimate_peak( 
+                instruments, gains, self.target_loudness if self.normalize else None, separted 
+            )
+            if peak > 0:
+                logger.warning( "the notes of an event can clip: peak up to %+.1f dBFS", peak )
+
         self.expr_display_on = expr_display_on
 
-        if separted:
-            self.instrument_display = InstrumentSeparateDisplay(
-                self, instruments, colors, on_opacities, off_opacities
-            )
-            self.instrument_player = InstrumentSeparatePlayer(
-                self, instruments, probabilities, gains, self.instrument_display, use = "nesting"
-            ) 
-        else:
-            self.instrument_display = InstrumentAlternateDisplay(
-                self, instruments, colors, off_opacities[0]  
-            )
-            self.instrument_player = InstrumentAlternatePlayer(
-                self, instruments, probabilities, gains, self.instrument_display, use = "nesting"
-            )
-        
         if  levels_on:
             self.level_display = LevelDisplay(self)
         else:
@@ -1603,7 +4656,23 @@ class TowerApp(Scene):
                 self, rule_title, rule_subtitle, rule_display_size
             )      
 
-        self.earth = Earth(-2, -5.5, 5.5)
+        self.earth = self.static( Earth(-2, -5.5, 5.5) )
+
+        # the instrument displays wait here for the icons still loading
+        if separted:
+            self.instrument_display = InstrumentSeparateDisplay(
+                self, instruments, colors, on_opacities, off_opacities
+            )
+            self.instrument_player = InstrumentSeparatePlayer(
+                self, instruments, probabilities, gains, self.instrument_display, use = "nesting"
+            ) 
+        else:
+            self.instrument_display = InstrumentAlternateDisplay(
+                self, instruments, colors, off_opacities[0]  
+            )
+            self.instrument_player = InstrumentAlternatePlayer(
+                self, instruments, probabilities, gains, self.instrument_display, use = "nesting"
+            )
 
         self.play( Create(self.earth) )
 
@@ -1616,8 +4685,183 @@ class TowerApp(Scene):
         anis1 = self.level_display.update(level = tower.count_floors())
         anis2 = self.subtowers_display.update(subtowers = tower.count_children())
 
-        if len(anis1)+len(anis2)>0:
-            self.play( *anis1, *anis2, run_time = 0.04 )
+        self.queue_hud( *anis1, *anis2, run_time = 0.04 )
+
+    # HUD animations (displays, earth) wait here for the next play
+    # and run in it, squished in their own run time: [(animation, run time)].
+    # Successive updates of a display (a replacement of the value it has just 
+    # got in the queue) become one replacement, from the first value to the last.
+    def queue_hud(self, *animations, run_time = 0.04):
+
+        for a in animations:
+            for k, (q, q_run_time) in enumerate(self.hud_queue):
+                if isinstance(a, ReplacementTransform) and isinstance(q, ReplacementTransform) \
+                        and a.mobject is q.target_mobject:
+                    self.hud_queue[k] = ( 
+                        ReplacementTransform(q.mobject, a.target_mobject), max(q_run_time, run_time) 
+                    )
+                    break
+            else:
+                self.hud_queue.append( (a, run_time) )
+
+    # plays the queued HUD animations on their own
+    def flush_hud(self):
+
+        if len(self.hud_queue) == 0:
+            return
+
+        queue = self.hud_queue
+        self.hud_queue = []
+        self.play( *[ a for a, run_time in queue ], run_time = max( run_time for a, run_time in queue ) )
+
+    # the queued HUD animations plus the animations of a play
+    def attach_hud(self, args, kwargs):
+
+        animations = [ prepare_animation(a) for a in args ]
+
+        # a wait stays a (static) wait: the HUD goes first, then the rest of the wait
+        hud_run_time = max( run_time for a, run_time in self.hud_queue )
+        if len(animations) == 1 and isinstance(animations[0], Wait) and len(kwargs) == 0:
+            wait = animations[0]
+            if wait.run_time>hud_run_time and wait.stop_condition is None:
+                self.flush_hud()
+                return [ Wait( wait.run_time - hud_run_time, frozen_frame = wait.is_static_wait ) ]
+
+        total = kwargs.get( "run_time", max( [a.run_time for a in animations] ) )
+
+        queue = self.hud_queue
+        self.hud_queue = []
+        for a, run_time in queue:
+            a.rate_func = squish_rate_func( a.rate_func, 0, min( 1, run_time/total ) )
+            a.run_time = total
+
+        return [ a for a, run_time in queue ] + animations
+
+    # queued HUD animations are not lost at the end of the scene
+    def tear_down(self):
+
+        self.flush_hud()
+        self.mix_sounds()
+        super().tear_down()
+
+    # called after every play with (number of plays, scene time), if set
+    progress = None
+
+    # every cull_every plays the mobjects fully outside the frame are removed (0: never)
+    cull_every = 20
+
+    def play(self, *args, **kwargs):
+        args = [ prepare_animation(a) for a in args ]
+        if len(self.hud_queue)>0:
+            args = self.attach_hud(args, kwargs)
+        self.update_static_layer(args)
+
+        if self.layer == "overlay" and not self.animates_overlays(args):
+            self.play_frozen(args, kwargs)
+        else:
+            super().play(*args, **kwargs)
+
+        if self.cull_every>0 and self.renderer.num_plays % self.cull_every == 0:
+            self.cull_offscreen()
+
+        if self.progress is not None:
+            self.progress( self.renderer.num_plays, self.renderer.time )
+
+    # true if the animations move or change an overlay (waits are played as they are)
+    def animates_overlays(self, animations):
+
+        if all( isinstance(a, Wait) for a in animations ):
+            return True
+
+        overlay_ids = { id(m) for o in self.overlays for m in o.get_family() }
+        for o in self.overlays:
+            if any( len(m.updaters)>0 for m in o.get_family() ):
+                return True
+
+        for a in animations:
+            for m in [ a.mobject, getattr(a, "target_mobject", None) ]:
+                if m is not None and any( id(f) in overlay_ids for f in m.get_family() ):
+                    return True
+
+        return False
+
+    # A play that leaves the overlays as they are, in the overlay layer: 
+    # the animations are only applied (as manim does skipping animations) 
+    # and the same frame is written as many times as the play writes frames
+    # in the base layer (a frozen wait of run time writes int(run_time*fps)
+    # frames, a play one per step of np.arange(0, run_time, 1/fps)).
+    def play_frozen(self, animations, kwargs):
+
+        run_time = kwargs.get( "run_time", max( [a.run_time for a in animations] ) )
+
+        renderer = self.renderer
+        skipping, time = renderer._original_skipping_status, renderer.time
+        renderer._original_skipping_status = True
+        try:
+            super().play(*animations, **kwargs)
+        finally:
+            renderer._original_skipping_status = skipping
+            renderer.time = time
+
+        frames = len( np.arange(0, run_time, 1 / config.frame_rate) )
+        if frames > 0:
+            super().play( Wait( (frames + 0.5) / config.frame_rate, frozen_frame = True ) )
+
+    # Removes the mobjects that are fully outside the frame, so they are not 
+    # updated nor drawn anymore. An animation of a removed mobject adds it back.
+    def cull_offscreen(self):
+
+        offscreen = [ m for m in self.mobjects if m.is_off_screen() ]
+        if len(offscreen)>0:
+            self.remove( *offscreen )
+
+        return offscreen
+
+    # add sound to the mixer (samples from the cache instead of decoding the file every time)
+    def add_sound(self, sound_file, time_offset=0, gain=None, **kwargs):
+        # the overlay layer has no sound, it goes with the base layer
+        if self.renderer.skip_animations or self.layer == "overlay":
+            return
+
+        self.mixer.add( sound_file, self.renderer.time + time_offset, gain, **kwargs )
+
+    # plays a note of an instrument and logs it: [(time, instrument, scale degree, gain)]
+    def add_note(self, instrument, number, gain = None):
+        if self.renderer.skip_animations or self.layer == "overlay":
+            return
+
+        # thinning: notes closer than 1/max_notes_per_second to the last one are dropped
+        # (notes at the same time are one event)
+        time = self.renderer.time
+        if self.max_notes_per_second > 0 and self.last_note_time is not None:
+            if time != self.last_note_time and time - self.last_note_time < 1 / self.max_notes_per_second:
+                return
+        self.last_note_time = time
+
+        self.note_log.append( (time, instrument, number, gain) )
+        if self.sounds_on:
+            for s in instrument.sounds(number):
+                g = gain or 0
+                if self.normalize:
+                    g += SampleLoudness.gain( s, self.target_loudness )
+                self.add_sound( s, gain = g )
+
+    # writes the mixed voices in the soundtrack
+    def mix_sounds(self):
+
+        voices = self.mixer.voices()
+        mixed = self.mixer.mix( [ voice[:4] for voice in voices if len(voice[4]) == 0 ] )
+        if mixed is not None:
+            self.mixer.check_clipping()
+            self.renderer.file_writer.add_audio_segment( mixed, 0 )
+
+        # options of the file writer (as gain_to_background) need its overlay
+        for time, sound_file, amplitude, keep, kwargs in voices:
+            if len(kwargs) > 0:
+                self.renderer.file_writer.add_audio_segment( 
+                    SoundMixer.segment(sound_file, amplitude, keep), time, **kwargs 
+                )
+        self.mixer.clear()
 
 
 
@@ -1639,6 +4883,8 @@ class TowerApp(Scene):
         # self.animateReveal()
         # self.animateCombo()
         # self.animateNumbers()
+        # self.animateOrdinals()
+        # self.animateRewrite()
 
         # self.try_string()
         # self.try_string_player()
@@ -1687,6 +4933,7 @@ class TowerApp(Scene):
             if s_old is not None:
                 s_old.flush(self, 0.02)
 
+            self.instrument_player.plan( s.raise_events() )
             s.raise_tower(self, transitions_run_time=0.04,)
             self.update_displays(s)
             s_old = s
@@ -1697,16 +4944,38 @@ class TowerApp(Scene):
 
     def play_set(  
         self, instruments, probabilities, sequence,
-        rule_display_size = 2, rule_display_txt = "♫♫"
+        rule_display_size = 2, rule_display_txt = "♫♫", thumbnail = False,
+        lod_pixels = 0, duration = None, max_notes_per_second = 10
     ):
         self.create_displays(
             instruments, None, probabilities,  
             rule_subtitle=rule_display_txt, rule_display_size=rule_display_size
         )
 
-        s , _ = Tower.from_string_bottom_up( sequence, 0,  7, 0.6, 0.2 )
+        # with lod_pixels, blocks smaller than lod_pixels are collapsed
+        if lod_pixels>0:
+            s = Tower.from_string_lod( sequence, lod_pixels, 1, 7, 0.6, 0.2 )
+        else:
+            s , _ = Tower.from_string_bottom_up( sequence, 0,  7, 0.6, 0.2 )
         s.animate.place_on_earth(self.earth)
 
+        # thumbnail: only the final state, the tower on earth and the displays updated
+        # (render with save_last_frame, so the plays are skipped and one frame is drawn)
+        if thumbnail:
+            s.place_on_earth(self.earth)
+            self.add(s)
+            self.instrument_display.vibrate( list(range(len(instruments))), 0 )
+            self.update_displays(s)
+            return
+
+        # with a duration the build takes that time (seconds) whatever the size
+        if duration is not None:
+            s.raise_tower_in(self, duration, max_notes_per_second)
+            self.wait(3)
+            return
+
+        # all the instrument choices of the build drawn at once
+        self.instrument_player.plan( s.raise_events() )
         s.raise_tower(self, transitions_run_time=0.04,)
 
         self.wait(3)
@@ -1734,9 +5003,9 @@ class TowerApp(Scene):
         off_opacities = [1 , 1]
         self.create_displays(
             instruments, colors, probabilities, None, on_opacities, off_opacities,
-            4, "Regla 1", "Fusión", 
-            # 4, "Regola 1", "Fusione",        
-            # 4, "Rule 1", "Merge", 
+            4, 
+            { "es": "Regla 1", "it": "Regola 1", "en": "Rule 1" }, 
+            { "es": "Fusión", "it": "Fusione", "en": "Merge" }, 
         )
 
         prova1 = "  < ( [()] [] ) [ (( ()() )[]) ] >  "
@@ -1817,7 +5086,7 @@ class TowerApp(Scene):
         self.wait(3)
 
         new_base = s.copy()
-        new_base.rect.set_color(YELLOW)
+        new_base.rect.set_fill(YELLOW)
         Tower.raise_towers_with_base(self, [s], new_base  )
         self.update_displays(s)
         new_base.set_subtowers([s])
@@ -1839,11 +5108,12 @@ class TowerApp(Scene):
         prova1 = " (  ) "
 
         v , _ = Tower.from_string_bottom_up( prova1, 0,  10, 0.6, 0.3 )
-        v.rect.set_color(BLUE)
+        v.rect.set_fill(BLUE)
 
-        # merge = Text("regla: fusión", font_size=18).move_to([0,2,0])
-        # merge = Text("regola: fusione", font_size=18).move_to([0,2,0])
-        merge = Text("rule: merge", font_size=18).move_to([0,2,0])
+        merge = self.localized_text( 
+            { "en": "rule: merge", "es": "regla: fusión", "it": "regola: fusione" }, 
+            font_size=18
+        ).move_to([0,2,0])
         self.play( Write(merge) )
 
         Tower.raise_towers_with_base(self, [t, u], v )
@@ -1851,9 +5121,10 @@ class TowerApp(Scene):
         self.wait(3)
 
 
-        # dup = Text("regla: borrar", font_size=18).move_to([0,2,0])
-        # dup = Text("regola: doppioni", font_size=18).move_to([0,2,0])
-        dup = Text("rule: erase", font_size=18).move_to([0,2,0])
+        dup = self.localized_text( 
+            { "en": "rule: erase", "es": "regla: borrar", "it": "regola: doppioni" }, 
+            font_size=18
+        ).move_to([0,2,0])
         self.play( ReplacementTransform(merge, dup) )
 
         v.remove_duplicate_subtowers( self, 0.5  )
@@ -1905,21 +5176,23 @@ class TowerApp(Scene):
 
         self.wait(2)
 
-        # merge = Text("regla: fusión", font_size=18).move_to([0,2,0])
-        merge = Text("regola: fusione", font_size=18).move_to([0,2,0])
-        # merge = Text("rule: merge", font_size=18).move_to([0,2,0])
+        merge = self.localized_text( 
+            { "it": "regola: fusione", "es": "regla: fusión", "en": "rule: merge" }, 
+            font_size=18
+        ).move_to([0,2,0])
         self.play( Write(merge) )
 
         base = Tower.raise_towers(self, [v,w])
-        self.play( base.rect.animate.set_color(BLUE_E) )
+        self.play( base.rect.animate.set_fill(BLUE_E) )
 
         self.update_displays(base)
 
         self.wait(2)
 
-        # dup = Text("regla: borrar", font_size=18).move_to([0,2,0])
-        dup = Text("regola: doppioni", font_size=18).move_to([0,2,0])
-        # dup = Text("rule: erase", font_size=18).move_to([0,2,0])
+        dup = self.localized_text( 
+            { "it": "regola: doppioni", "es": "regla: borrar", "en": "rule: erase" }, 
+            font_size=18
+        ).move_to([0,2,0])
         self.play( ReplacementTransform(merge, dup) )
         base.remove_duplicate_subtowers_recursively(self)
 
@@ -1942,9 +5215,9 @@ class TowerApp(Scene):
         off_opacities = [1 , 1]
         self.create_displays(
             instruments, colors, probabilities, None, on_opacities, off_opacities,
-            # 5, "Rule 4", "First Floor"
-            # 5, "Regla 4", "Primer Piso"
-            5, "Regola 4", "Primo Piano"
+            5, 
+            { "it": "Regola 4", "es": "Regla 4", "en": "Rule 4" },
+            { "it": "Primo Piano", "es": "Primer Piso", "en": "First Floor" }
         )
 
         prova1 = "  < [ (( ()() )[]) ] ( [()] [] ) [[]] []>  "
@@ -1969,9 +5242,9 @@ class TowerApp(Scene):
         off_opacities = [1 , 1]
         self.create_displays(
             instruments, colors, probabilities, None, on_opacities, off_opacities,
-            4, "Regola 3", "Doppioni"
-            # 4, "Regla 3", "Borrar"
-            # 4, "Rule 3", "Erase"
+            4, 
+            { "it": "Regola 3", "es": "Regla 3", "en": "Rule 3" },
+            { "it": "Doppioni", "es": "Borrar", "en": "Erase" }
         )
 
         prova1 = "  < [( () )[]] ( [()] [] ) ( [()] ()()() )    >  "
@@ -2000,9 +5273,9 @@ class TowerApp(Scene):
         off_opacities = [1 , 1]
         self.create_displays(
             instruments, colors, probabilities, None, on_opacities, off_opacities,
-            4, "Regola 3", "Doppioni"
-            # 4, "Regla 3", "Borrar"
-            # 4, "Rule 3", "Erase"
+            4, 
+            { "it": "Regola 3", "es": "Regla 3", "en": "Rule 3" },
+            { "it": "Doppioni", "es": "Borrar", "en": "Erase" }
         )
 
         prova1 = "  < [( () )[]] ( [()] [] ) ( [()] ()()() )    >  "
@@ -2032,9 +5305,10 @@ class TowerApp(Scene):
         off_opacities = [1 , 1]
         self.create_displays(
             instruments, colors, probabilities, gains, on_opacities, off_opacities,
-            # 3, "Rule 0", "Start", True, False, False
-            # 3, "Regla 0", "Inicio", True, False, False        
-            3, "Regola 0", "Inizio", True, False, False
+            3, 
+            { "it": "Regola 0", "es": "Regla 0", "en": "Rule 0" },
+            { "it": "Inizio", "es": "Inicio", "en": "Start" }, 
+            True, False, False
         )
 
         prova1 = "  <  >  "
@@ -2076,9 +5350,9 @@ class TowerApp(Scene):
         off_opacities = [1 , 1]
         self.create_displays(
             instruments, colors, probabilities, None, on_opacities, off_opacities,
-            4, "Rule 2", "Swap"
-            # 4, "Regla 2", "Cambio"
-            # 4, "Regola 2", "Scambio"         
+            4, 
+            { "en": "Rule 2", "es": "Regla 2", "it": "Regola 2" },
+            { "en": "Swap", "es": "Cambio", "it": "Scambio" }
         )
 
         prova1 = "  < [( () )[]] ( [()] [] ) ( [()] ()()() )    >  "
@@ -2168,9 +5442,10 @@ class TowerApp(Scene):
         off_opacities = [1 , 1]
         self.create_displays(
             instruments, colors, probabilities, None, on_opacities, off_opacities,
-            3, "Regola 7", "Città", True, True, False 
-            # 3, "Regla 7", "Ciudad", True, True, False
-            # 3, "Rule 7", "City", True, True, False
+            3, 
+            { "it": "Regola 7", "es": "Regla 7", "en": "Rule 7" },
+            { "it": "Città", "es": "Ciudad", "en": "City" }, 
+            True, True, False 
         )
 
         prova1 = "  < [] [[]] [[[]]] [[[[]]]] [[[[[]]]]] [[[[[[]]]]]] [[[[[[[]]]]]]] [[[[[[[[]]]]]]]] >  "
@@ -2250,7 +5525,7 @@ class TowerApp(Scene):
         new_bases = s.raise_subtowers_with_new_base(self)
 
         for t in new_bases:
-            self.play( t.border.animate.set_color(WHITE), run_time = 0.2 )
+            self.play( t.rect.animate.set_stroke(WHITE), run_time = 0.2 )
 
 
         self.wait(1)
@@ -2310,7 +5585,7 @@ class TowerApp(Scene):
             bases.append( base.subtowers[1] )
 
         for b in bases:
-            self.play( b.rect.animate.set_color( BLUE_A ), run_time = 0.2 )
+            self.play( b.rect.animate.set_fill( BLUE_A ), run_time = 0.2 )
 
         self.wait(1)
 
@@ -2324,9 +5599,9 @@ class TowerApp(Scene):
         off_opacities = [1, 1]
         self.create_displays(
             instruments, colors, probabilities, None, on_opacities, off_opacities,
-            5, "La Regla de Fusión es", "Redundante"  
-            # 5, "La Regola di Fusione è", "Ridondante"
-            # 5, "Merge Rule is", "Redundant"
+            5, 
+            { "es": "La Regla de Fusión es", "it": "La Regola di Fusione è", "en": "Merge Rule is" },
+            { "es": "Redundante", "it": "Ridondante", "en": "Redundant" }
         )
 
         prova1 = "  < >  "
@@ -2347,9 +5622,10 @@ class TowerApp(Scene):
         s.move_to([0,1,0])
         self.play( Create(s) )
 
-        combo = Text("regla: combo", font_size=18).move_to([0,2,0])
-        # combo = Text("regola: combo", font_size=18).move_to([0,2,0])
-        # combo = Text("rule: combo", font_size=18).move_to([0,2,0])
+        combo = self.localized_text( 
+            { "es": "regla: combo", "it": "regola: combo", "en": "rule: combo" }, 
+            font_size=18
+        ).move_to([0,2,0])
         self.play( Write(combo) )
 
         self.wait(2)
@@ -2357,7 +5633,7 @@ class TowerApp(Scene):
         prova2 = "<>"
 
         t , _ = Tower.from_string_bottom_up( prova2, 0,  3, 0.7, 0.3 )
-        t.rect.set_color(BLUE)
+        t.rect.set_fill(BLUE)
         t.drop_tower(self)
 
         self.update_displays(t)
@@ -2371,7 +5647,7 @@ class TowerApp(Scene):
 
         self.wait(1)
 
-        combo2 = combo.copy()
+        combo2 = self.overlay( combo.copy() )
         self.play( 
             t.animate.shift([0,2,0]),
             Uncreate(combo)
@@ -2387,7 +5663,7 @@ class TowerApp(Scene):
         prova3 = "<>"
 
         z , _ = Tower.from_string_bottom_up( prova3, 0,  7, 0.7, 0.3 )
-        z.rect.set_color(BLUE)
+        z.rect.set_fill(BLUE)
         z.drop_tower(self)
 
         u.drop_tower_to_base( self, z )
@@ -2418,9 +5694,10 @@ class TowerApp(Scene):
         base3.align_to([base1.get_right()[0],0,0], RIGHT)
         self.play( Create(base3) )
 
-        combo = Text("regla: Transformación", font_size=18).move_to([0,2,0]) 
-        # combo = Text("regola: Trasformazione", font_size=18).move_to([0,2,0])
-        # combo = Text("rule: Transform", font_size=18).move_to([0,2,0])
+        combo = self.localized_text( 
+            { "es": "regla: Transformación", "it": "regola: Trasformazione", "en": "rule: Transform" }, 
+            font_size=18
+        ).move_to([0,2,0]) 
         self.play( Write(combo) )
 
         rock1b = rock1.copy()
@@ -2449,9 +5726,9 @@ class TowerApp(Scene):
         off_opacities = [1 , 1]
         self.create_displays(
             instruments, colors, probabilities, None, on_opacities, off_opacities,
-            # 3, "Rule 8", "Combo"
-            # 3, "Regla 8", "Combo"
-            3, "Regola 8", "Combo"
+            3, 
+            { "it": "Regola 8", "es": "Regla 8", "en": "Rule 8" },
+            "Combo"
         )
 
         prova1 = "  < [[]] (() (()))  [[[]] [[]]]  >  "
@@ -2469,7 +5746,7 @@ class TowerApp(Scene):
         self.wait(3)
 
         t , _ = Tower.from_string_bottom_up( prova2, 0,  13.8, 0.7, 0.3 )
-        t.rect.set_color(BLUE)
+        t.rect.set_fill(BLUE)
         t.drop_tower(self)
 
         self.wait(2)
@@ -2681,6 +5958,65 @@ class TowerApp(Scene):
         self.wait(1)
 
 
+    # animate Ordinals: von Neumann ordinals from the lazy generator, 
+    # deep levels collapsed in summary blocks
+    def animateOrdinals(self, count = 12, max_levels = 3):
+        instruments = [Bass, Tom]
+        probabilities = [1, 0.5]
+        colors = [RED, ORANGE ]
+        on_opacities = [1, 1]
+        off_opacities = [1 , 1]
+        self.create_displays(
+            instruments, colors, probabilities, None, on_opacities, off_opacities,            
+            4, None, { "es": "Ordinales", "it": "Ordinali", "en": "Ordinals" }
+        )
+
+        ordinals = canonical_sets.ordinals()
+        s_old = None
+        for n in range(count):
+            s = Tower.from_set( next(ordinals), max_levels = max_levels, block_width = 7, block_height = 0.6 )
+            s.move_to([0, 4, 0])
+            if s_old is not None:
+                s_old.flush(self, 0.2)
+            s.drop_tower(self)
+            self.update_displays(s)
+            s_old = s
+
+        self.wait(1)
+
+
+
+    # rule 6 with the rewrite engine: every member gets a new base, 
+    # then the singletons are unwrapped again
+    def animateRewrite(self):
+        instruments = [Tom, GuitarChoords]
+        probabilities = [0.9, 0.9]
+        colors = [RED, YELLOW_B ]
+        on_opacities = [1, 1]
+        off_opacities = [1 , 1]
+        self.create_displays(
+            instruments, colors, probabilities, None, on_opacities, off_opacities,
+            6, 
+            { "es": "Regla 6", "it": "Regola 6", "en": "Rule 6" }, 
+            { "es": "Transformación", "it": "Trasformazione", "en": "Transform" }
+        )
+
+        prova1 = "  < [( () )[]] ( [()] [] ) ( [()] ()()() )    >  "
+
+        s , _ = Tower.from_string_bottom_up( prova1, 0,  7, 1, 0.3 )
+        s.raise_tower(self)
+
+        self.wait(2)
+
+        s = s.rewrite( self, [ RewriteRule("X", "(X)", depth = 1) ] )
+        self.update_displays(s)
+        self.wait(2)
+
+        s = s.rewrite( self, [ RewriteRule("((X))", "(X)") ] )
+        self.update_displays(s)
+        self.wait(2)
+
+
 
     #start here if you wanna experiment with the code
 
@@ -2692,3 +6028,242 @@ class TowerApp(Scene):
 
         self.play_set( instruments, probabilities, sequence )
 
+
+
+
+# ---------------------------------
+
+# scene rendering a single job of the daemon (same options as play_set)
+class TowerJob(TowerApp):
+
+    def __init__(self, options, progress = None, **kwargs):
+        super().__init__(**kwargs)
+        self.options = options
+        self.progress = progress
+
+    def construct(self):
+
+        self.play_set( **self.options )
+
+
+# Long lived process that keeps manim, fonts, icons and samples warm
+# and renders play_set jobs received on a unix socket.
+# A job is a json line like:
+#   { "sequence": " ( () (()) ) ", "instruments": ["Tom", "Bass"], 
+#     "probabilities": [1, 0.5], "rule_display_size": 2, "rule_display_txt": "♫♫",
+#     "audio_only": false, "output": "my_clip" }
+# Thumbnail jobs have "thumbnail": true and optionally "pixel_width" and "pixel_height".
+# With "duration" (seconds) the tower is built in that time, whatever its size.
+# Midi jobs have "midi": true: no scene is rendered, the notes are timed on a
+# virtual clock (MidiExport.play_set_notes) and the answer is a .mid file.
+# The daemon answers with json lines: "progress" events and a final "done" or "error".
+# Jobs are rendered one at a time (the manim config is global).
+class TowerDaemon():
+
+    def __init__(self, socket_path, instruments = None):
+
+        self.socket_path = socket_path
+
+        if instruments is None:
+            instruments = TowerDaemon.known_instruments().values()
+        self.preload(instruments)
+
+    # instruments defined in this file, by name
+    @staticmethod
+    def known_instruments():
+        return { 
+            name: value for name, value in globals().items() 
+            if isinstance(value, Instrument) 
+        }
+
+    # parses the icons, decodes the samples and lets manim cache the text of the displays
+    def preload(self, instruments):
+
+        for instrument in instruments:
+            instrument.load_icon()
+        SampleCache.preload(instruments)
+        for n in range(10):
+            TextCache.text( str(n), color = Tower.select_color_by_level(n) )
+
+    # play_set options from a job
+    @staticmethod
+    def job_options(job):
+
+        known = TowerDaemon.known_instruments()
+        for name in job["instruments"]:
+            if name not in known:
+                raise ValueError("unknown instrument: " + name)
+
+        options = {
+            "instruments": [ known[name] for name in job["instruments"] ],
+            "probabilities": job["probabilities"],
+            "sequence": job["sequence"],
+        }
+        for key in [
+            "rule_display_size", "rule_display_txt", "thumbnail", "lod_pixels", 
+            "duration", "max_notes_per_second"
+        ]:
+            if key in job:
+                options[key] = job[key]
+
+        return options
+
+    # render a job, returns the path of the video (or of the audio, the midi or the thumbnail)
+    @staticmethod
+    def render(job, progress = None):
+
+        options = TowerDaemon.job_options(job)
+        audio_only = job.get("audio_only", False)
+        midi = job.get("midi", False)
+        thumbnail = job.get("thumbnail", False)
+        output = job.get("output")
+
+        overrides = {}
+        if output is not None:
+            overrides["output_file"] = output
+        if thumbnail:
+            overrides.update( { "write_to_movie": False, "save_last_frame": True } )
+            for key in ["pixel_width", "pixel_height"]:
+                if key in job:
+                    overrides[key] = job[key]
+        elif audio_only:
+            # sounds are placed by scene time, so frames can be almost free
+            # (the frame rate stays: the scene time advances by whole frames)
+            overrides.update( {
+                "write_to_movie": False, "save_last_frame": False,
+                "pixel_width": 16, "pixel_height": 9,
+            } )
+
+        # the notes are timed on a virtual clock, no scene is constructed
+        if midi:
+            with tempconfig(overrides):
+                midi_dir = os.path.join( config.get_dir("media_dir"), "midi" )
+                os.makedirs(midi_dir, exist_ok = True)
+                return MidiExport.save( 
+                    MidiExport.play_set_notes(**options),
+                    os.path.join( midi_dir, (output or "TowerJob") + ".mid" ) 
+                )
+
+        with tempconfig(overrides):
+            scene = TowerJob(options, progress)
+            scene.render()
+
+            if thumbnail:
+                return str(scene.renderer.file_writer.image_file_path)
+
+            if not audio_only:
+                return str(scene.renderer.file_writer.movie_file_path)
+
+            # the file writer has no audio_segment until a sound is added
+            audio = getattr( scene.renderer.file_writer, "audio_segment", None )
+            if audio is None:
+                audio = AudioSegment.silent( duration = int(scene.renderer.time*1000) )
+
+            audio_dir = os.path.join( config.get_dir("media_dir"), "audio" )
+            os.makedirs(audio_dir, exist_ok = True)
+            path = os.path.join( audio_dir, (output or "TowerJob") + ".wav" )
+            audio.export(path, format = "wav")
+
+            return path
+
+    def serve(self):
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        with socketserver.UnixStreamServer(self.socket_path, TowerDaemonHandler) as server:
+            server.tower_daemon = self
+            server.serve_forever()
+
+    # send a job to a running daemon, yields the messages of the daemon
+    @staticmethod
+    def submit(socket_path, job):
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(socket_path)
+            s.sendall( (json.dumps(job) + "\n").encode("utf-8") )
+
+            for line in s.makefile("r", encoding = "utf-8"):
+                message = json.loads(line)
+                yield message
+                if message["event"] in ["done", "error"]:
+                    return
+
+
+# one connection = one job
+class TowerDaemonHandler(socketserver.StreamRequestHandler):
+
+    def send(self, message):
+        self.wfile.write( (json.dumps(message) + "\n").encode("utf-8") )
+        self.wfile.flush()
+
+    def handle(self):
+
+        def progress(plays, time):
+            self.send( { "event": "progress", "plays": plays, "time": time } )
+
+        try:
+            job = json.loads( self.rfile.readline() )
+            output = self.server.tower_daemon.render(job, progress)
+            self.send( { "event": "done", "output": output } )
+        except Exception as e:
+            self.send( { "event": "error", "message": str(e) } )
+
+
+# python torres.py daemon <socket>
+# python torres.py submit <socket> <job.json>
+# python torres.py thumbnails <jobs.jsonl>      (one job per line, rendered as thumbnails)
+# python torres.py sketch <file|-|string> <file.svg|file.png>     (-: the string from stdin)
+# python torres.py stats <file>
+# python torres.py midi <job.json>
+# python torres.py treeedit-check [max blocks]      (edit scripts against brute force)
+if __name__ == "__main__":
+
+    if len(sys.argv) == 3 and sys.argv[1] == "daemon":
+        TowerDaemon(sys.argv[2]).serve()
+
+    elif len(sys.argv) == 4 and sys.argv[1] == "submit":
+        with open(sys.argv[3], encoding = "utf-8") as f:
+            job = json.load(f)
+        for message in TowerDaemon.submit(sys.argv[2], job):
+            print( json.dumps(message) )
+
+    elif len(sys.argv) == 3 and sys.argv[1] == "thumbnails":
+        with open(sys.argv[2], encoding = "utf-8") as f:
+            for n, line in enumerate(f):
+                if line.strip() == "":
+                    continue
+                job = json.loads(line)
+                job["thumbnail"] = True
+                job.setdefault("output", "thumb" + str(n))
+                print( TowerDaemon.render(job) )
+
+    elif len(sys.argv) == 4 and sys.argv[1] == "sketch":
+        sketch = TowerSketch( TowerSketch.read(sys.argv[2]) )
+        if sys.argv[3].endswith(".png"):
+            print( sketch.save_png(sys.argv[3]) )
+        else:
+            print( sketch.save_svg(sys.argv[3]) )
+
+    elif len(sys.argv) == 3 and sys.argv[1] == "stats":
+        print( json.dumps( TowerStats.from_file(sys.argv[2], use_mmap = True).as_dict() ) )
+
+    elif len(sys.argv) == 3 and sys.argv[1] == "midi":
+        with open(sys.argv[2], encoding = "utf-8") as f:
+            job = json.load(f)
+        job["midi"] = True
+        print( TowerDaemon.render(job) )
+
+    elif len(sys.argv) in [2, 3] and sys.argv[1] == "treeedit-check":
+        failures = TreeEdit.check( int(sys.argv[2]) if len(sys.argv) == 3 else 5 )
+        for failure in failures:
+            print( "%s -> %s: distance %d, minimum %d" % failure )
+        print( "ok" if len(failures) == 0 else "%d failures" % len(failures) )
+        sys.exit( 0 if len(failures) == 0 else 1 )
+
+    else:
+        print(
+            "usage: python torres.py daemon <socket> | submit <socket> <job.json>"
+            " | thumbnails <jobs.jsonl> | sketch <file|-|string> <file.svg|file.png> | stats <file>"
+            " | midi <job.json> | treeedit-check [max blocks]"
+        )